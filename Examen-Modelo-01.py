@@ -93,25 +93,50 @@ El departamento de mantenimiento predictivo en el **Complejo Petroquímico Ana M
 Se le suministra un archivo con miles de lecturas crudas. Su tarea es calcular los errores fundamentales comparando el **Promedio de las mediciones** ($V_{medido}$) contra el **Valor Estándar de Calibración** ($V_{real}$).
 """)
 
-# Definir valores reales (Standards) aleatorios pero realistas
-std_presion = random.randint(1200, 1500) # PSI
-std_temp = random.randint(450, 600)      # Grados C
-std_flujo = random.randint(80, 120)      # L/min
-
-# Generar Dataset ruidoso
-n_rows = 500
-data = {
-    "Lectura_ID": [f"L-{i:04d}" for i in range(n_rows)],
-    "Presion_PSI_PlantaA": np.random.normal(std_presion + random.uniform(-15, 15), 5.5, n_rows).round(2),
-    "Temp_C_HornoB": np.random.normal(std_temp + random.uniform(-8, 8), 2.1, n_rows).round(2),
-    "Flujo_Lmin_TuberiaC": np.random.normal(std_flujo + random.uniform(-2, 2), 0.8, n_rows).round(2)
-}
-df = pd.DataFrame(data)
+# Todo lo aleatorio vive dentro de generar_escenario(): se calcula una sola vez
+# por estudiante (cache) y no en cada rerun. Debe seguir llamándose justo después
+# de sembrar para que las cifras sean las mismas con o sin caché.
+# Lo que devuelve cache() es compartido: tratarlo como solo lectura.
+def generar_escenario():
+    # Definir valores reales (Standards) aleatorios pero realistas
+    std_presion = random.randint(1200, 1500) # PSI
+    std_temp = random.randint(450, 600)      # Grados C
+    std_flujo = random.randint(80, 120)      # L/min
+
+    # Generar Dataset ruidoso
+    n_rows = 500
+    data = {
+        "Lectura_ID": [f"L-{i:04d}" for i in range(n_rows)],
+        "Presion_PSI_PlantaA": np.random.normal(std_presion + random.uniform(-15, 15), 5.5, n_rows).round(2),
+        "Temp_C_HornoB": np.random.normal(std_temp + random.uniform(-8, 8), 2.1, n_rows).round(2),
+        "Flujo_Lmin_TuberiaC": np.random.normal(std_flujo + random.uniform(-2, 2), 0.8, n_rows).round(2)
+    }
+    df = pd.DataFrame(data)
+
+    # Crear archivo descargable
+    csv_buffer = io.StringIO()
+    df.to_csv(csv_buffer, index=False)
+
+    # --- CÁLCULO DE LA SOLUCIÓN CORRECTA ---
+    soluciones = {}
+    for clave, columna, std_val in [("e1", "Presion_PSI_PlantaA", std_presion),   # Ejercicio 1: Presión
+                                    ("e2", "Temp_C_HornoB", std_temp),            # Ejercicio 2: Temperatura
+                                    ("e3", "Flujo_Lmin_TuberiaC", std_flujo)]:    # Ejercicio 3: Flujo
+        mean_val = df[columna].mean()
+        e_abs = abs(std_val - mean_val)
+        e_rel = e_abs / std_val
+        soluciones[clave] = [mean_val, e_abs, e_rel, e_rel * 100]
+
+    return {
+        "std": (std_presion, std_temp, std_flujo),
+        "csv_data": csv_buffer.getvalue(),
+        "soluciones": soluciones,
+    }
 
-# Crear archivo descargable
-csv_buffer = io.StringIO()
-df.to_csv(csv_buffer, index=False)
-csv_data = csv_buffer.getvalue()
+escenario = cache("escenario", generar_escenario)
+std_presion, std_temp, std_flujo = escenario["std"]
+csv_data = escenario["csv_data"]
+soluciones = escenario["soluciones"]
 
 st.download_button(
     label="📥 Descargar Dataset de Lecturas (CSV)",
@@ -121,32 +146,6 @@ st.download_button(
     type="secondary"
 )
 
-# --- CÁLCULO DE LA SOLUCIÓN CORRECTA ---
-# Ejercicio 1: Presión
-mean_presion = df["Presion_PSI_PlantaA"].mean()
-e_abs_1 = abs(std_presion - mean_presion)
-e_rel_1 = e_abs_1 / std_presion
-e_por_1 = e_rel_1 * 100
-
-# Ejercicio 2: Temperatura
-mean_temp = df["Temp_C_HornoB"].mean()
-e_abs_2 = abs(std_temp - mean_temp)
-e_rel_2 = e_abs_2 / std_temp
-e_por_2 = e_rel_2 * 100
-
-# Ejercicio 3: Flujo
-mean_flujo = df["Flujo_Lmin_TuberiaC"].mean()
-e_abs_3 = abs(std_flujo - mean_flujo)
-e_rel_3 = e_abs_3 / std_flujo
-e_por_3 = e_rel_3 * 100
-
-# Guardar soluciones en diccionario
-soluciones = {
-    "e1": [mean_presion, e_abs_1, e_rel_1, e_por_1],
-    "e2": [mean_temp, e_abs_2, e_rel_2, e_por_2],
-    "e3": [mean_flujo, e_abs_3, e_rel_3, e_por_3]
-}
-
 # 2.3 INTERFAZ DE USUARIO (Frontend)
 st.info("Para el valor medido ($V_m$), calcule el **promedio aritmético** de todos los datos de la columna correspondiente en el archivo CSV. **Verifique** que ha completado las 3 pestañas **antes** de enviar.")
 
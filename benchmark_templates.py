@@ -0,0 +1,185 @@
+"""
+Benchmark de plantillas de examen.
+
+Ejecuta cada plantilla sin interfaz (SilentStreamlit de exam_runner) para un
+conjunto fijo de cédulas y mide, por render:
+  - tiempo (mediana, p95 y mínimo de varias repeticiones)
+  - pico de memoria asignada (tracemalloc, en una pasada aparte porque
+    tracemalloc hace más lento el código)
+  - llamadas a la BD (check_student_status, register_attempt)
+
+Guarda los resultados en JSON y, si se da --baseline, los compara con una
+corrida anterior y marca las plantillas que empeoraron (código de salida 1).
+El baseline se crea con --save-baseline en la máquina donde se va a comparar;
+no tiene sentido comparar tiempos medidos en máquinas distintas.
+
+Uso:
+    python benchmark_templates.py --save-baseline bench_baseline.json
+    python benchmark_templates.py --baseline bench_baseline.json --out bench_actual.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import exam_runner
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATES = ["Plantilla-IA*.py", "Examen-Modelo-01.py", "examenPrueba.py"]
+# Cédulas fijas: cada una es una semilla distinta para las plantillas
+DEFAULT_SEEDS = ["10234567", "18765432", "24681357", "27182818", "31415926"]
+
+
+class CountingDB(exam_runner.MockDB):
+    """MockDB que cuenta las llamadas que haría la plantilla a la BD real."""
+    def __init__(self):
+        self.calls = Counter()
+
+    def check_student_status(self, exam_id, student_id):
+        self.calls["check_student_status"] += 1
+        return super().check_student_status(exam_id, student_id)
+
+    def register_attempt(self, *args, **kwargs):
+        self.calls["register_attempt"] += 1
+        return super().register_attempt(*args, **kwargs)
+
+
+def render_once(code, exam_id, student_id):
+    """Un render completo de la plantilla. Retorna (segundos, llamadas a la BD, error)."""
+    context = exam_runner.build_context(exam_id, student_id)
+    db = context["db"] = CountingDB()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        exec(code, context)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return time.perf_counter() - t0, db.calls, error
+
+
+def bench_template(path, seeds, repeats):
+    exam_id = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8") as f:
+        code = compile(exam_runner.sanitize(f.read()), path, "exec")
+
+    times, errors, db_calls = [], set(), Counter()
+    for sid in seeds:
+        render_once(code, exam_id, sid)  # Calentamiento (imports perezosos, cachés de numpy/pandas)
+        for _ in range(repeats):
+            seconds, calls, error = render_once(code, exam_id, sid)
+            times.append(seconds)
+            db_calls.update(calls)
+            if error:
+                errors.add(error)
+
+    # Memoria: una pasada por cédula con tracemalloc activo, nos quedamos con el mayor pico
+    peak = 0
+    for sid in seeds:
+        tracemalloc.start()
+        render_once(code, exam_id, sid)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    arr = np.array(times) * 1000
+    renders = len(times)
+    return {
+        "render_ms": {
+            "median": float(np.median(arr)),
+            "p95": float(np.percentile(arr, 95)),
+            "min": float(arr.min()),
+        },
+        "peak_kib": peak / 1024,
+        "db_calls_per_render": {name: n / renders for name, n in sorted(db_calls.items())},
+        "renders": renders,
+        "errors": sorted(errors),
+    }
+
+
+def compare(current, baseline, time_tol, mem_tol, noise_ms):
+    """Lista de (plantilla, mensaje) para cada métrica que empeoró más allá de la tolerancia."""
+    regressions = []
+    for name, cur in current["templates"].items():
+        base = baseline.get("templates", {}).get(name)
+        if base is None:
+            continue
+        t_cur, t_base = cur["render_ms"]["median"], base["render_ms"]["median"]
+        if t_cur > t_base * (1 + time_tol) and t_cur - t_base > noise_ms:
+            regressions.append((name, f"tiempo mediano {t_base:.1f} → {t_cur:.1f} ms (+{(t_cur / max(t_base, 1e-9) - 1):.0%})"))
+        m_cur, m_base = cur["peak_kib"], base["peak_kib"]
+        if m_cur > m_base * (1 + mem_tol):
+            regressions.append((name, f"pico de memoria {m_base:.0f} → {m_cur:.0f} KiB (+{(m_cur / max(m_base, 1e-9) - 1):.0%})"))
+        for call, n in cur["db_calls_per_render"].items():
+            n_base = base.get("db_calls_per_render", {}).get(call, 0)
+            if n > n_base + 1e-9:
+                regressions.append((name, f"{call}: {n_base:g} → {n:g} llamadas por render"))
+        if cur["errors"] and not base.get("errors"):
+            regressions.append((name, f"ahora falla: {cur['errors'][0]}"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de plantillas de examen (sin interfaz).")
+    parser.add_argument("templates", nargs="*", help="Archivos a medir (por defecto, las plantillas del repo)")
+    parser.add_argument("--seeds", nargs="+", default=DEFAULT_SEEDS, help="Cédulas a usar como semillas")
+    parser.add_argument("--repeats", type=int, default=5, help="Renders medidos por cédula")
+    parser.add_argument("--out", default="bench_results.json", help="Dónde guardar los resultados")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior con el cual comparar")
+    parser.add_argument("--save-baseline", metavar="RUTA", help="Guardar esta corrida como baseline")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="Aumento de tiempo tolerado (0.25 = 25%%)")
+    parser.add_argument("--mem-tolerance", type=float, default=0.20, help="Aumento de memoria tolerado")
+    parser.add_argument("--noise-ms", type=float, default=2.0, help="Diferencias de tiempo menores se ignoran")
+    args = parser.parse_args()
+
+    paths = args.templates or sorted({p for pat in DEFAULT_TEMPLATES for p in glob.glob(os.path.join(HERE, pat))})
+    results = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "seeds": args.seeds,
+            "repeats": args.repeats,
+        },
+        "templates": {},
+    }
+
+    print(f"{'plantilla':<24}{'mediana ms':>11}{'p95 ms':>9}{'pico KiB':>10}  llamadas BD/render")
+    for path in paths:
+        name = os.path.basename(path)
+        r = results["templates"][name] = bench_template(path, args.seeds, args.repeats)
+        calls = ", ".join(f"{k}={v:g}" for k, v in r["db_calls_per_render"].items()) or "-"
+        print(f"{name:<24}{r['render_ms']['median']:>11.1f}{r['render_ms']['p95']:>9.1f}{r['peak_kib']:>10.0f}  {calls}")
+        for error in r["errors"]:
+            print(f"    ⚠️  {error}")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nBaseline guardado en {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tolerance, args.mem_tolerance, args.noise_ms)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones respecto a {args.baseline}:")
+            for name, message in regressions:
+                print(f"  - {name}: {message}")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones respecto a {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
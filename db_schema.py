@@ -0,0 +1,382 @@
+"""
+Esquema y SQL de microlms: migraciones versionadas, el registro QUERIES con
+todas las sentencias de DatabaseManager, el SQL dinámico del libro de notas y
+del dashboard, y la auditoría de planes de consulta.
+
+Vive fuera de microlms.py (igual que exam_runner) para que la auditoría se
+pueda correr en las pruebas: microlms.py no se puede importar sin levantar
+toda la app de Streamlit. Aquí no se importa streamlit.
+"""
+import sqlite3
+from datetime import datetime, timezone
+
+# ==============================================================================
+# MIGRACIONES DEL ESQUEMA (Versionadas)
+# ==============================================================================
+# Cada paso se aplica UNA sola vez y queda anotado en la tabla schema_version.
+# Reglas: nunca editar un paso ya publicado (agregar uno nuevo al final) y que
+# cada sentencia sea idempotente (IF NOT EXISTS / OR IGNORE), porque dos
+# instancias pueden arrancar al mismo tiempo. ADD COLUMN no tiene IF NOT EXISTS:
+# apply_migrations ignora el error de columna duplicada.
+SCHEMA_MIGRATIONS = [
+    (1, "Tablas base: grades y exams", [
+        """
+        CREATE TABLE IF NOT EXISTS grades (
+            exam_id TEXT,
+            student_id TEXT,
+            attempts INTEGER DEFAULT 0,
+            score REAL DEFAULT 0,
+            is_correct BOOLEAN DEFAULT 0,
+            last_updated TIMESTAMP,
+            PRIMARY KEY (exam_id, student_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS exams (
+            exam_id TEXT PRIMARY KEY,
+            source_code TEXT,
+            created_at TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Contador de aprobados por examen (exam_stats)", [
+        # Orden de llegada para la nota competitiva. Se incrementa en la misma
+        # transacción que el upsert de la nota.
+        """
+        CREATE TABLE IF NOT EXISTS exam_stats (
+            exam_id TEXT PRIMARY KEY,
+            passed_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # Exámenes con aprobados anteriores al contador arrancan con su conteo real
+        """
+        INSERT OR IGNORE INTO exam_stats (exam_id, passed_count)
+        SELECT exam_id, COUNT(*) FROM grades WHERE is_correct=1 GROUP BY exam_id
+        """,
+    ]),
+    (3, "Índices de las consultas calientes", [
+        "CREATE INDEX IF NOT EXISTS idx_grades_exam_correct ON grades (exam_id, is_correct)",
+        "CREATE INDEX IF NOT EXISTS idx_grades_last_updated ON grades (last_updated)",
+        "CREATE INDEX IF NOT EXISTS idx_exams_created_at ON exams (created_at)",
+    ]),
+    (4, "Índices para ordenar y buscar en el libro de notas paginado", [
+        "CREATE INDEX IF NOT EXISTS idx_grades_score ON grades (score)",
+        "CREATE INDEX IF NOT EXISTS idx_grades_student ON grades (student_id)",
+    ]),
+    (5, "Índice del ranking: aprobados de un examen ya ordenados por nota y llegada", [
+        "CREATE INDEX IF NOT EXISTS idx_grades_leaderboard ON grades (exam_id, is_correct, score DESC, last_updated)",
+        # Su prefijo (exam_id, is_correct) ya cubre al índice viejo: un índice menos que mantener por escritura
+        "DROP INDEX IF EXISTS idx_grades_exam_correct",
+    ]),
+    (6, "Huella y metadatos del código validado al guardar un examen", [
+        "ALTER TABLE exams ADD COLUMN source_hash TEXT",
+        "ALTER TABLE exams ADD COLUMN metadata TEXT",
+    ]),
+    (7, "Versión monótona de cada examen (sube con cada guardado)", [
+        "ALTER TABLE exams ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+def apply_migrations(conn):
+    """
+    Lleva el esquema a la última versión de SCHEMA_MIGRATIONS.
+    Retorna la versión final. Sirve igual para libsql que para sqlite3.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    current = row[0] or 0
+
+    for version, description, statements in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        for statement in statements:
+            try:
+                conn.execute(statement)
+            except Exception as e:
+                # Otra instancia ya agregó la columna (ADD COLUMN no es idempotente)
+                if "duplicate column" not in str(e).lower():
+                    raise
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+            (version, description, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+        current = version
+
+    return current
+
+# NOTA SOBRE EL SQL:
+# Hemos cambiado la lógica de "score =" para que:
+# 1. Si el intento actual APROBÓ (excluded.is_correct), se guarde la nueva nota (10-20).
+# 2. Si ya estaba APROBADO antes (grades.is_correct), se mantenga la nota vieja (no se puede bajar nota).
+# 3. Si REPRUEBA (y no ha aprobado antes), se guarde la nota calculada por Gauss (0-9).
+_UPSERT_GRADE_SQL = """
+        INSERT INTO grades (exam_id, student_id, attempts, is_correct, score, last_updated)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(exam_id, student_id) DO UPDATE SET
+            attempts = attempts + excluded.attempts,
+            
+            -- Si ya aprobó alguna vez (grades.is_correct), se queda aprobado (MAX). 
+            -- Si no, toma el valor del intento actual.
+            is_correct = MAX(grades.is_correct, excluded.is_correct),
+            
+            score = CASE 
+                WHEN excluded.is_correct THEN excluded.score  -- Nuevo aprobado: Actualizar nota
+                WHEN grades.is_correct THEN grades.score      -- Ya aprobado antes: Mantener nota
+                ELSE excluded.score                           -- Reprobado: Guardar nota Gaussiana (0-9)
+            END,
+            
+            last_updated = excluded.last_updated
+"""
+
+# ==============================================================================
+# CONSULTAS DE DatabaseManager (Registro central)
+# ==============================================================================
+# TODA sentencia que ejecute DatabaseManager vive aquí con un nombre. Así
+# audit_query_plans() puede revisarlas todas y ninguna consulta nueva se escapa.
+QUERIES = {
+    "check_student_status": """
+        SELECT score FROM grades WHERE exam_id=? AND student_id=? AND is_correct=1
+    """,
+    # Reclama el puesto de llegada de un aprobado (O(1) y atómico). Si el alumno
+    # ya había aprobado no inserta nada y no devuelve fila.
+    "claim_pass_position": """
+        INSERT INTO exam_stats (exam_id, passed_count)
+        SELECT ?, 1
+        WHERE NOT EXISTS (
+            SELECT 1 FROM grades WHERE exam_id=? AND student_id=? AND is_correct=1
+        )
+        ON CONFLICT(exam_id) DO UPDATE SET passed_count = passed_count + 1
+        RETURNING passed_count, (SELECT attempts FROM grades WHERE exam_id=? AND student_id=?)
+    """,
+    "get_passed_student": """
+        SELECT attempts, (SELECT passed_count FROM exam_stats WHERE exam_id=?)
+        FROM grades WHERE exam_id=? AND student_id=?
+    """,
+    # RETURNING nos devuelve lo que realmente quedó guardado (intentos y nota
+    # preservada) sin otra consulta.
+    "upsert_grade": _UPSERT_GRADE_SQL + """
+        RETURNING attempts, score
+    """,
+    # Misma escritura sin RETURNING para executemany (búfer de escritura diferida)
+    "upsert_grade_batch": _UPSERT_GRADE_SQL,
+    # Estado completo de un alumno + contador del examen en UNA lectura
+    "get_attempt_state": """
+        SELECT
+            (SELECT attempts FROM grades WHERE exam_id=? AND student_id=?),
+            (SELECT is_correct FROM grades WHERE exam_id=? AND student_id=?),
+            (SELECT score FROM grades WHERE exam_id=? AND student_id=?),
+            (SELECT passed_count FROM exam_stats WHERE exam_id=?)
+    """,
+    "add_pass_positions": """
+        INSERT INTO exam_stats (exam_id, passed_count) VALUES (?, ?)
+        ON CONFLICT(exam_id) DO UPDATE SET passed_count = passed_count + excluded.passed_count
+    """,
+    # Ranking público: solo los aprobados de UN examen, numerados por la BD
+    "get_leaderboard": """
+        SELECT ROW_NUMBER() OVER (ORDER BY score DESC, last_updated) AS rank,
+               student_id, score, attempts
+        FROM grades
+        WHERE exam_id = ? AND is_correct = 1
+        ORDER BY score DESC, last_updated
+    """,
+    # "Mi posición": cuántos aprobados van delante (más nota, o igual nota y antes).
+    # Son dos conteos por rango sobre idx_grades_leaderboard; un OR no usaría el índice.
+    "get_leaderboard_position": """
+        SELECT 1
+               + (SELECT COUNT(*) FROM grades g
+                  WHERE g.exam_id = me.exam_id AND g.is_correct = 1 AND g.score > me.score)
+               + (SELECT COUNT(*) FROM grades g
+                  WHERE g.exam_id = me.exam_id AND g.is_correct = 1 AND g.score = me.score
+                    AND g.last_updated < me.last_updated),
+               me.score, me.attempts
+        FROM grades me
+        WHERE me.exam_id = ? AND me.student_id = ? AND me.is_correct = 1
+    """,
+    # Exportación por bloques: paginación por clave (keyset) sobre la clave primaria,
+    # cada bloque arranca justo después de la última fila del anterior (sin OFFSET)
+    "export_grades_chunk": """
+        SELECT exam_id, student_id, attempts, score, is_correct, last_updated
+        FROM grades
+        WHERE (exam_id, student_id) > (?, ?)
+        ORDER BY exam_id, student_id
+        LIMIT ?
+    """,
+    "get_grade_exam_ids": """
+        SELECT DISTINCT exam_id FROM grades ORDER BY exam_id
+    """,
+    "get_exam_list": """
+        SELECT exam_id FROM exams ORDER BY created_at DESC
+    """,
+    "get_exam_code": """
+        SELECT source_code FROM exams WHERE exam_id=?
+    """,
+    "get_exam_meta": """
+        SELECT source_hash, metadata FROM exams WHERE exam_id=?
+    """,
+    # Consulta barata (sin el código) que cada proceso repite para enterarse de ediciones
+    "get_exam_version": """
+        SELECT version, source_hash FROM exams WHERE exam_id=?
+    """,
+    "save_exam": """
+        INSERT INTO exams (exam_id, source_code, created_at, source_hash, metadata, version) VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT(exam_id) DO UPDATE SET 
+            source_code = excluded.source_code,
+            created_at = excluded.created_at,
+            source_hash = excluded.source_hash,
+            metadata = excluded.metadata,
+            version = exams.version + 1
+    """,
+    "delete_exam": """
+        DELETE FROM exams WHERE exam_id=?
+    """,
+}
+
+# --- Libro de notas paginado (SQL dinámico: filtros opcionales y orden elegido) ---
+# Cada orden termina en una columna única para que las páginas no se solapen, y
+# todos los prefijos de orden tienen índice (rowid va implícito al final de cada índice).
+GRADE_SORTS = {
+    "last_updated": "last_updated DESC, rowid DESC",
+    "score": "score DESC, rowid DESC",
+    "student_id": "student_id ASC, rowid ASC",
+    "exam_id": "exam_id ASC, student_id ASC",
+}
+GRADES_PAGE_SQL = "SELECT * FROM grades {where} ORDER BY {order} LIMIT ? OFFSET ?"
+GRADES_COUNT_SQL = "SELECT COUNT(*) FROM grades {where}"
+
+# --- Dashboard docente: agregados calculados en la BD (solo viajan los resultados) ---
+# Segmentos del informe. Son condiciones fijas del código, nunca texto del usuario.
+DASHBOARD_SEGMENTS = {
+    "struggling": "score < 9.5 AND attempts > 3",   # Intentan mucho y no aprueban
+    "guessers": "score >= 9.5 AND attempts > 4",    # Aprueban por persistencia
+    "elite": "score >= 19.0 AND attempts = 1",      # Nota excelente al primer intento
+}
+DASHBOARD_SQL = {
+    "dashboard_kpis": f"""
+        SELECT COUNT(DISTINCT student_id),
+               COUNT(DISTINCT CASE WHEN is_correct = 1 THEN student_id END),
+               COUNT(*),
+               AVG(score),
+               AVG(CASE WHEN is_correct = 1 THEN score END),
+               AVG(CASE WHEN is_correct = 1 THEN attempts END),
+               SUM(score), SUM(attempts), MIN(score), MAX(score),
+               SUM({DASHBOARD_SEGMENTS['struggling']}),
+               SUM({DASHBOARD_SEGMENTS['guessers']}),
+               SUM({DASHBOARD_SEGMENTS['elite']})
+        FROM grades {{where}}
+    """,
+    # Nota redondeada (0-20) separada en reprobados (< 9.5) y aprobados
+    "dashboard_histogram": """
+        SELECT CAST(ROUND(score) AS INTEGER) AS nota, score >= 9.5 AS aprobado, COUNT(*) AS n
+        FROM grades {where}
+        GROUP BY nota, aprobado
+    """,
+    # last_updated es texto 'YYYY-MM-DD HH:MM:SS': los 10 primeros caracteres son el día
+    "dashboard_activity": """
+        SELECT substr(last_updated, 1, 10) AS dia, COUNT(*) AS registros
+        FROM grades {where}
+        GROUP BY dia ORDER BY dia
+    """,
+    # Dispersión Esfuerzo vs. Nota agregada en burbujas (intentos, nota entera, estado)
+    "dashboard_bubbles": """
+        SELECT attempts, CAST(ROUND(score) AS INTEGER) AS nota, is_correct, COUNT(*) AS estudiantes
+        FROM grades {where}
+        GROUP BY attempts, nota, is_correct
+    """,
+    "dashboard_segment": """
+        SELECT student_id, exam_id, attempts, score
+        FROM grades {where}
+        ORDER BY score DESC, attempts
+    """,
+}
+
+def build_grades_filter(exam_ids=None, id_prefix="", extra=None):
+    """
+    Arma el WHERE del libro de notas. Los valores del usuario siempre van como
+    parámetros. El prefijo de cédula es un rango [prefijo, prefijo + U+FFFF)
+    para que use el índice de student_id (un LIKE no lo haría). `extra` es una
+    condición fija del código (p. ej. un segmento del dashboard).
+    Retorna (where_sql, params). params es una tupla: libsql no acepta listas.
+    """
+    clauses, params = ([f"({extra})"] if extra else []), []
+    if exam_ids:
+        clauses.append(f"exam_id IN ({', '.join('?' * len(exam_ids))})")
+        params.extend(exam_ids)
+    if id_prefix:
+        clauses.append("student_id >= ? AND student_id < ?")
+        params.extend([id_prefix, id_prefix + "\uffff"])
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, tuple(params)
+
+def grades_page_queries(exam_ids=None, id_prefix="", sort_by="last_updated", page=1, page_size=50):
+    """
+    (sql, params) del conteo y de una página del libro de notas. Las usa
+    DatabaseManager.query_grades y las prueban los tests contra libsql.
+    """
+    where, params = build_grades_filter(exam_ids, id_prefix)
+    offset = (max(int(page), 1) - 1) * page_size
+    return (
+        (GRADES_COUNT_SQL.format(where=where), params),
+        (GRADES_PAGE_SQL.format(where=where, order=GRADE_SORTS[sort_by]), (*params, page_size, offset)),
+    )
+
+def dashboard_queries(exam_ids=None):
+    """{nombre: (sql, params)} de las consultas agregadas del dashboard (sin la de segmento)."""
+    where, params = build_grades_filter(exam_ids)
+    return {name: (sql.format(where=where), params)
+            for name, sql in DASHBOARD_SQL.items() if name != "dashboard_segment"}
+
+def segment_query(exam_ids, segment):
+    """(sql, params) con las filas de un segmento del dashboard."""
+    where, params = build_grades_filter(exam_ids, extra=DASHBOARD_SEGMENTS[segment])
+    return DASHBOARD_SQL["dashboard_segment"].format(where=where), params
+
+def query_plan_cases():
+    """Todo lo que se audita: QUERIES más variantes representativas del SQL dinámico."""
+    cases = list(QUERIES.items())
+    for exam_ids, id_prefix in [(None, ""), (["a", "b"], ""), (None, "12"), (["a"], "12")]:
+        where, _ = build_grades_filter(exam_ids, id_prefix)
+        cases.append(("query_grades_count", GRADES_COUNT_SQL.format(where=where)))
+        for sort_by, order in GRADE_SORTS.items():
+            cases.append((f"query_grades_page[{sort_by}]", GRADES_PAGE_SQL.format(where=where, order=order)))
+    # El dashboard sin filtro agrega la tabla entera a propósito; se audita filtrado por examen
+    for name, sql in DASHBOARD_SQL.items():
+        extra = DASHBOARD_SEGMENTS["struggling"] if name == "dashboard_segment" else None
+        where, _ = build_grades_filter(["a", "b"], extra=extra)
+        cases.append((name, sql.format(where=where)))
+    return cases
+
+def audit_query_plans():
+    """
+    Pasa EXPLAIN QUERY PLAN a cada consulta de QUERIES sobre una BD SQLite en
+    memoria con el mismo esquema (libsql usa el mismo planificador).
+    Retorna la lista de problemas: tablas recorridas completas sin índice, u
+    ORDER BY resuelto con un B-tree temporal sobre un recorrido completo (ordenar
+    el subconjunto que ya acotó un índice sí se permite). Lista vacía = todo indexado.
+    """
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        return []  # Sin RETURNING no podemos planificar las sentencias de escritura
+
+    mem = sqlite3.connect(":memory:")
+    try:
+        apply_migrations(mem)
+        problems = []
+        for name, sql in query_plan_cases():
+            params = (None,) * sql.count("?")
+            details = [row[3] for row in mem.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            # Recorrer una subconsulta ya materializada (p. ej. la de una ventana) no es recorrer una tabla
+            scans = [d for d in details
+                     if d.startswith("SCAN") and "CONSTANT ROW" not in d and not d.startswith("SCAN (")]
+            for detail in details:
+                full_scan = detail in scans and "USING" not in detail
+                if full_scan or ("USE TEMP B-TREE" in detail and scans):
+                    problems.append(f"{name}: {detail}")
+        return problems
+    finally:
+        mem.close()
@@ -0,0 +1,573 @@
+"""
+Ejecución "sin cabeza" de exámenes (sin interfaz) para el Solucionador.
+
+Cada ejecución corre en un subproceso aislado con límite de tiempo de CPU, de
+memoria y un tiempo máximo de reloj tras el cual se mata: una plantilla con un
+bucle infinito o una matriz gigante no congela ni infla el servidor que
+comparten los estudiantes.
+
+Vive fuera de microlms.py porque los subprocesos importan este módulo desde
+cero, y microlms.py no se puede importar sin levantar toda la app de
+Streamlit. Aquí no se importa streamlit.
+"""
+import os
+import time
+import random
+import hashlib
+import builtins
+import importlib
+import threading
+import signal
+import types
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:  # Solo existe en Unix; en otros sistemas queda el límite de reloj
+    import resource
+except ImportError:
+    resource = None
+
+# Variables de respuesta comunes, en el orden en que se muestran
+PRIORITY_VARS = ['solucion', 'soluciones', 'solucion_correcta', 'solution', 'respuesta', 'result', 'answer']
+
+# Límites por defecto de cada ejecución aislada
+DEFAULT_TIMEOUT_SECONDS = 20.0   # Reloj: pasado esto se mata el proceso
+DEFAULT_CPU_SECONDS = 10         # Tiempo de CPU (RLIMIT_CPU)
+DEFAULT_MEMORY_MB = 2048         # Espacio de direcciones (RLIMIT_AS); numpy/pandas ya reservan bastante
+
+# Módulos pesados que las plantillas usan a veces: se inyectan como proxies y
+# se importan recién al primer uso (nombre en el contexto -> módulo)
+LAZY_MODULES = {
+    'scipy': 'scipy',
+    'plt': 'matplotlib.pyplot',
+    'px': 'plotly.express',
+    'go': 'plotly.graph_objects',
+    'fpdf': 'fpdf',
+}
+
+# Variables que inyectamos nosotros (no son resultado del examen)
+BASE_CONTEXT_KEYS = {
+    'st', 'pd', 'np', 'random', 'db', 'EXAM_ID', 'datetime',
+    'is_admin', 'cache', '__builtins__'
+} | set(LAZY_MODULES)
+
+# ==============================================================================
+# CLASE MOCK SESSION STATE (Para soportar notación de punto .clave)
+# ==============================================================================
+class MockSessionState(dict):
+    """
+    Simula el comportamiento híbrido de st.session_state:
+    Funciona como diccionario (state['key']) y como objeto (state.key).
+    """
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(f"'MockSessionState' object has no attribute '{key}'")
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+# ==============================================================================
+# STREAMLIT SILENCIOSO
+# ==============================================================================
+class SilentStreamlit:
+    """
+    Simula ser 'st' para ejecutar el examen sin interfaz gráfica.
+    Devuelve tipos de datos compatibles para evitar TypeErrors durante la simulación.
+    `secrets` es un dict simple (st.secrets no viaja a otro proceso).
+    """
+    def __init__(self, fixed_input, secrets=None):
+        self.fixed_input = str(fixed_input)
+        self.secrets = secrets if secrets is not None else {}
+
+        # 1. Usamos MockSessionState en vez de un dict normal para permitir .user_session
+        self.session_state = MockSessionState()
+
+        # 2. INYECCIÓN DE SESIÓN:
+        # Pre-llenamos los datos para que la Plantilla v9 crea que ya estamos logueados.
+        # Esto evita que el script se detenga en la pantalla de login.
+        self.session_state.user_session = {
+            "verified": True,
+            "id": self.fixed_input,
+            "section": "ACADEMIA TEC" # Sección por defecto para simulaciones
+        }
+
+    # --- PROPIEDADES DE LAYOUT ---
+    @property
+    def sidebar(self):
+        return self
+
+    def container(self, **kwargs):
+        return self
+
+    def columns(self, spec, **kwargs):
+        count = spec if isinstance(spec, int) else len(spec)
+        return [self] * count
+
+    def tabs(self, tabs_list, **kwargs):
+        return [self] * len(tabs_list)
+
+    def expander(self, label, **kwargs):
+        return self
+
+    def form(self, key, **kwargs):
+        return self
+
+    # --- WIDGETS DE ENTRADA (Manejo de Tipos de Datos) ---
+
+    def text_input(self, label, **kwargs):
+        # Si el label sugiere que es el ID, devolvemos el ID fijo.
+        label_lower = label.lower()
+        if "id" in label_lower or "cédula" in label_lower or "cedula" in label_lower:
+            return self.fixed_input
+        # Si pide nombre para el badge, devolvemos un nombre falso
+        if "nombre" in label_lower:
+            return "Estudiante Simulado"
+        return "dummy_text"
+
+    def number_input(self, label, **kwargs):
+        return 1.0
+
+    def slider(self, label, min_value=0, max_value=100, **kwargs):
+        return min_value
+
+    def radio(self, label, options, **kwargs):
+        return options[0] if options else None
+
+    def selectbox(self, label, options, **kwargs):
+        return options[0] if options else None
+
+    def multiselect(self, label, options, **kwargs):
+        return [options[0]] if options else []
+
+    def checkbox(self, label, **kwargs):
+        return False
+
+    def button(self, label, **kwargs):
+        # Importante: devolver False para botones de acción (como Login o Emitir Badge)
+        # para que no intenten ejecutar lógica externa, EXCEPTO si es form_submit
+        return False
+
+    def date_input(self, label, **kwargs):
+        from datetime import date
+        return date.today()
+
+    def time_input(self, label, **kwargs):
+        from datetime import datetime
+        return datetime.now().time()
+
+    def file_uploader(self, label, **kwargs):
+        return None
+
+    def form_submit_button(self, label="Submit", **kwargs):
+        # Simulamos que el botón de enviar respuesta SIEMPRE se presiona
+        # para forzar el cálculo de validación
+        return True
+
+    # --- MÉTODOS DE SALIDA (No hacen nada) ---
+    def markdown(self, *args, **kwargs): pass
+    def title(self, *args, **kwargs): pass
+    def header(self, *args, **kwargs): pass
+    def subheader(self, *args, **kwargs): pass
+    def caption(self, *args, **kwargs): pass
+    def code(self, *args, **kwargs): pass
+    def write(self, *args, **kwargs): pass
+    def info(self, *args, **kwargs): pass
+    def success(self, *args, **kwargs): pass
+    def warning(self, *args, **kwargs): pass
+    def error(self, *args, **kwargs): pass
+    def json(self, *args, **kwargs): pass
+    def metric(self, *args, **kwargs): pass
+    def toast(self, *args, **kwargs): pass
+    def balloons(self, *args, **kwargs): pass
+    def spinner(self, *args, **kwargs): return self
+    def link_button(self, *args, **kwargs): pass
+
+    # --- CONTROL DE FLUJO ---
+    def stop(self):
+        # Ignoramos stop() para que el script siga corriendo y revele las variables
+        pass
+
+    def rerun(self):
+        pass
+
+    # --- CONTEXT MANAGERS ---
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __iter__(self):
+        yield self
+
+    def __getattr__(self, name):
+        # Catch-all para cualquier cosa que se nos haya olvidado
+        return lambda *args, **kwargs: self
+
+
+class MockDB:
+    """Simula la BD para forzar que el examen se ejecute (ignora si ya aprobó)."""
+    def check_student_status(self, exam_id, student_id):
+        # Siempre dice que NO ha aprobado para que el código calcule la solución
+        return {"has_passed": False, "score": 0}
+
+    def register_attempt(self, *args, **kwargs):
+        return 0, 0
+
+# ==============================================================================
+# RESOLVER UN EXAMEN PARA UNA CÉDULA
+# ==============================================================================
+def sanitize(source_code):
+    """Quita los imports de streamlit: el examen usa el 'st' que le inyectamos."""
+    safe_lines = [
+        line for line in source_code.split('\n')
+        if not line.strip().startswith("import streamlit")
+        and not line.strip().startswith("from streamlit")
+    ]
+    return "\n".join(safe_lines)
+
+# ==============================================================================
+# ALEATORIEDAD AISLADA POR EJECUCIÓN
+# ==============================================================================
+class _IsolatedModule(types.ModuleType):
+    """
+    Se hace pasar por `random` o `numpy.random`, pero las funciones de azar
+    (seed, randint, normal, choice...) salen de un generador propio de esta
+    ejecución; lo demás (clases, constantes) viene del módulo real.
+    Si la plantilla sortea algo sin haber llamado seed(), el generador se
+    siembra antes con default_seed().
+    """
+    def __init__(self, module, generator, default_seed):
+        super().__init__(module.__name__, module.__doc__)
+        self._module = module
+        self._generator = generator
+        self._default_seed = default_seed
+        self._seeded = False
+
+    def __getattr__(self, name):
+        generator = self.__dict__['_generator']
+        if name.startswith('_') or not hasattr(generator, name):
+            return getattr(self.__dict__['_module'], name)
+        if name == 'seed':
+            self._seeded = True
+        elif not self._seeded:
+            generator.seed(self._default_seed())
+            self._seeded = True
+        return getattr(generator, name)
+
+class _IsolatedNumpy(types.ModuleType):
+    """numpy real, salvo np.random, que es el de esta ejecución."""
+    def __init__(self, random_module):
+        super().__init__(np.__name__, np.__doc__)
+        self.random = random_module
+
+    def __getattr__(self, name):
+        return getattr(np, name)
+
+def isolated_randomness(context, exam_id):
+    """
+    Entradas de contexto con `random` y `np` propios de una ejecución, para
+    que los reruns de distintos estudiantes (hilos del mismo proceso) no se
+    mezclen los sorteos al sembrar los generadores globales.
+
+    Se usan random.Random y np.random.RandomState (no np.random.Generator):
+    sembrados igual producen exactamente los mismos números que los
+    generadores globales, así ningún estudiante ve cambiar su examen.
+    El __import__ propio cubre las plantillas que hacen `import random` o
+    `import numpy as np` por su cuenta.
+    """
+    def default_seed():
+        # Solo si la plantilla sortea sin sembrar: depende de la cédula ingresada
+        key = f"{exam_id}:{context.get('student_id') or ''}"
+        return int.from_bytes(hashlib.sha256(key.encode()).digest()[:4], "big")
+
+    rng_random = _IsolatedModule(random, random.Random(0), default_seed)
+    rng_numpy = _IsolatedNumpy(_IsolatedModule(np.random, np.random.RandomState(0), default_seed))
+
+    def isolated_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0:
+            if name == 'random':
+                return rng_random
+            if name == 'numpy':
+                return rng_numpy
+            if name == 'numpy.random':
+                return rng_numpy.random if fromlist else rng_numpy
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    exam_builtins = dict(vars(builtins))
+    exam_builtins['__import__'] = isolated_import
+    return {'random': rng_random, 'np': rng_numpy, '__builtins__': exam_builtins}
+
+# ==============================================================================
+# MÓDULOS PESADOS PEREZOSOS
+# ==============================================================================
+class LazyModule(types.ModuleType):
+    """
+    Proxy de un módulo que se importa al primer acceso a un atributo
+    (plt.plot, scipy.stats...). Mientras ninguna plantilla lo use, el
+    arranque en frío no paga su importación.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, name):
+        module = self.__dict__['_module'] or self._load()
+        return getattr(module, name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+# Compartidos por todas las ejecuciones: una vez importado, el proxy solo reenvía
+_LAZY_PROXIES = {name: LazyModule(module) for name, module in LAZY_MODULES.items()}
+
+def lazy_modules():
+    """Entradas de contexto con los proxies de LAZY_MODULES."""
+    return dict(_LAZY_PROXIES)
+
+def passthrough_cache(key, fn):
+    """cache(clave, fn) sin memoria: en el solucionador cada ejecución es única."""
+    return fn()
+
+def build_context(exam_id, student_id, secrets=None):
+    """Contexto inicial del examen con ST y DB simulados."""
+    context = {
+        'st': SilentStreamlit(student_id, secrets),
+        'pd': pd,
+        'np': np,
+        'random': random,
+        'db': MockDB(),
+        'EXAM_ID': exam_id,
+        'datetime': datetime,
+        'is_admin': True,
+        'cache': passthrough_cache
+    }
+    context.update(lazy_modules())
+    context.update(isolated_randomness(context, exam_id))
+    return context
+
+def _plain(value, depth=0):
+    """Convierte un valor del examen a algo que se pueda enviar entre procesos y mostrar."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if depth > 20:  # Estructuras cíclicas o absurdamente anidadas
+        return repr(value)
+    if isinstance(value, dict):
+        return {str(k): _plain(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_plain(v, depth + 1) for v in value]
+    # Solo arrays y Series reales: SilentStreamlit responde cualquier atributo (también .tolist)
+    if isinstance(value, (np.ndarray, pd.Series)):
+        return _plain(value.tolist(), depth + 1)
+    return repr(value)
+
+def _is_layout(value):
+    """Columnas, pestañas, contenedores... de SilentStreamlit (no son resultados)."""
+    if isinstance(value, (list, tuple)) and value:
+        return all(isinstance(v, SilentStreamlit) for v in value)
+    return isinstance(value, SilentStreamlit)
+
+def collect_variables(context):
+    """Todo lo que generó el examen y no es basura (ni módulos, funciones, clases o layout)."""
+    results_found = {}
+    for k, v in context.items():
+        # Ignorar variables internas (_) o las que inyectamos nosotros
+        if k.startswith('_') or k in BASE_CONTEXT_KEYS:
+            continue
+        # Ignorar Módulos, Funciones y Clases (solo queremos datos)
+        if isinstance(v, (types.ModuleType, types.FunctionType, type)) or _is_layout(v):
+            continue
+        try:
+            results_found[k] = _plain(v)
+        except Exception as e:  # Una variable rara no debe tumbar todo el resultado
+            results_found[k] = f"<no se pudo convertir: {type(e).__name__}>"
+    return results_found
+
+def solve_for_student(code, exam_id, student_id, secrets=None):
+    """
+    Ejecuta el examen (fuente ya sanitizada o code object) para una cédula.
+    Retorna un dict serializable: student_id, seconds, error, priority
+    (variables de respuesta encontradas) y variables (todas las demás).
+    """
+    context = build_context(exam_id, student_id, secrets)
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        exec(code, context)
+    except CPUTimeExceeded:
+        status, error = "timeout", "Tiempo de CPU agotado"
+    except MemoryError:
+        status, error = "memory", "Memoria agotada"
+    except Exception as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+    try:
+        variables = collect_variables(context)
+    except Exception as e:
+        variables = {}
+        if status == "ok":
+            status, error = "error", f"No se pudieron leer las variables: {type(e).__name__}: {e}"
+    return {
+        "student_id": str(student_id),
+        "seconds": time.perf_counter() - start,
+        "status": status,
+        "error": error,
+        "priority": {var: variables[var] for var in PRIORITY_VARS if var in variables},
+        "variables": variables,
+    }
+
+def _failed(student_id, status, error, seconds=None):
+    return {"student_id": str(student_id), "seconds": seconds, "status": status, "error": error,
+            "priority": {}, "variables": {}}
+
+# ==============================================================================
+# EJECUCIÓN AISLADA (Subproceso con límites de CPU, memoria y reloj)
+# ==============================================================================
+class CPUTimeExceeded(Exception):
+    """Se lanza dentro del subproceso al recibir SIGXCPU (límite blando de CPU)."""
+
+def _on_sigxcpu(signum, frame):
+    raise CPUTimeExceeded()
+
+def _apply_limits(cpu_seconds, memory_mb):
+    if resource is None:
+        return
+    if cpu_seconds:
+        # Límite blando: el kernel manda SIGXCPU y lo convertimos en excepción.
+        # El duro queda un poco más arriba por si el examen está dentro de código C.
+        used = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(used.ru_utime + used.ru_stime) + int(cpu_seconds)
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 5))
+    if memory_mb:
+        limit = int(memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _isolated_entry(conn, source_code, exam_id, student_id, secrets, cpu_seconds, memory_mb):
+    """Punto de entrada del subproceso: aplica límites, ejecuta y devuelve el resultado por la tubería."""
+    _apply_limits(cpu_seconds, memory_mb)
+    try:
+        code = compile(sanitize(source_code), f"<examen:{exam_id}>", "exec")
+        result = solve_for_student(code, exam_id, student_id, secrets)
+    except SyntaxError as e:
+        result = _failed(student_id, "error", f"SyntaxError: {e}")
+    try:
+        conn.send(result)
+    except MemoryError:
+        conn.send(_failed(student_id, "memory", "Memoria agotada al enviar el resultado"))
+    conn.close()
+
+_context = None
+
+def _mp_context():
+    """
+    'forkserver' con este módulo precargado: cada subproceso nace de un servidor
+    limpio que ya importó numpy y pandas (arranque de milisegundos, sin copiar
+    los hilos de Streamlit). Donde no existe (Windows) se usa 'spawn'.
+    """
+    global _context
+    if _context is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            _context = multiprocessing.get_context("forkserver")
+            _context.set_forkserver_preload([__name__])
+        else:
+            _context = multiprocessing.get_context("spawn")
+    return _context
+
+def solve_isolated(source_code, exam_id, student_id, secrets=None,
+                   timeout=DEFAULT_TIMEOUT_SECONDS, cpu_seconds=DEFAULT_CPU_SECONDS, memory_mb=DEFAULT_MEMORY_MB):
+    """
+    Resuelve el examen para una cédula en un subproceso propio.
+    Siempre retorna un resultado serializable; si el proceso se pasa del tiempo
+    o lo mata el sistema, `status` es "timeout" o "memory" con un error legible.
+    """
+    ctx = _mp_context()
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_isolated_entry, daemon=True,
+                       args=(child_conn, source_code, exam_id, str(student_id), secrets, cpu_seconds, memory_mb))
+    start = time.perf_counter()
+    proc.start()
+    child_conn.close()
+    try:
+        if parent_conn.poll(timeout):
+            try:
+                return parent_conn.recv()
+            except EOFError:
+                pass  # Murió sin responder: se diagnostica abajo por el código de salida
+        else:
+            proc.kill()
+            proc.join()
+            return _failed(student_id, "timeout", f"Tiempo agotado: superó {timeout:.0f} s y se detuvo",
+                           time.perf_counter() - start)
+    finally:
+        parent_conn.close()
+
+    proc.join(5)
+    elapsed = time.perf_counter() - start
+    code = proc.exitcode
+    if code == -getattr(signal, "SIGXCPU", 0):
+        return _failed(student_id, "timeout", f"Tiempo de CPU agotado ({cpu_seconds} s)", elapsed)
+    if code == -getattr(signal, "SIGKILL", 9) or code is None:
+        if code is None:
+            proc.kill()
+        return _failed(student_id, "memory", f"Proceso terminado por el sistema (posible falta de memoria, límite {memory_mb} MB)", elapsed)
+    return _failed(student_id, "error", f"El proceso terminó inesperadamente (código {code})", elapsed)
+
+# ==============================================================================
+# LOTE: CLAVE DE RESPUESTAS DE TODA UNA SECCIÓN (Un subproceso aislado por cédula)
+# ==============================================================================
+def solve_batch(source_code, exam_id, student_ids, secrets=None, max_workers=None, on_result=None, **limits):
+    """
+    Resuelve el examen para cada cédula, hasta un subproceso aislado por núcleo a
+    la vez (un proceso de pool no se puede matar sin tumbar todo el pool).
+    `limits` se pasa a solve_isolated. `on_result(resultado)` se llama a medida
+    que cada cédula termina (para una barra de progreso). Retorna los resultados
+    en el mismo orden de `student_ids`.
+    """
+    student_ids = list(dict.fromkeys(str(s).strip() for s in student_ids if str(s).strip()))
+    if not student_ids:
+        return []
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(student_ids)))
+    results = {}
+    # Los hilos solo esperan a su subproceso: el trabajo pesado ocurre fuera del servidor
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="solver") as pool:
+        futures = {pool.submit(solve_isolated, source_code, exam_id, sid, secrets, **limits): sid
+                   for sid in student_ids}
+        for future in as_completed(futures):
+            sid = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:  # p. ej. no se pudo crear el subproceso
+                result = _failed(sid, "error", f"{type(e).__name__}: {e}")
+            results[sid] = result
+            if on_result:
+                on_result(result)
+    return [results[sid] for sid in student_ids]
+
+def results_to_frame(results):
+    """Una fila por cédula: tiempo, error y una columna por variable de respuesta."""
+    rows = []
+    for r in results:
+        row = {"student_id": r["student_id"], "tiempo_s": r["seconds"], "estado": r["status"], "error": r["error"] or ""}
+        for var in PRIORITY_VARS:
+            if var in r["priority"]:
+                value = r["priority"][var]
+                row[var] = value if isinstance(value, (str, int, float)) else str(value)
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    extra = [c for c in PRIORITY_VARS if c in df.columns]
+    return df[["student_id"] + extra + ["tiempo_s", "estado", "error"]] if not df.empty else df
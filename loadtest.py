@@ -0,0 +1,498 @@
+"""
+Prueba de carga: N estudiantes presentando el mismo examen a la vez.
+
+Se levanta UN servidor real (`streamlit run microlms.py`) y se le conectan N
+sesiones por el mismo WebSocket que usa el navegador, todas desde un único
+bucle asyncio. Así se mide la capacidad de una instancia: las sesiones
+comparten el pool de conexiones, las cachés (cache_resource / cache_data), el
+búfer de escritura diferida y el GIL del proceso del servidor. En lugar de
+Turso se usa un archivo SQLite local.
+
+Cada estudiante ingresa su cédula, llena el formulario y envía respuestas
+correctas o incorrectas (según --wrong-ratio) hasta aprobar o agotar
+--attempts. Se reporta el throughput y los percentiles p50/p95/p99 de:
+  - render:  reruns sin envío (cargar, ingresar, contestar)
+  - submit:  reruns que envían (incluyen db.register_attempt)
+medidos desde que se manda el rerun hasta que el servidor avisa que el script
+terminó, y, desde el textfile de Prometheus que escribe el servidor, la
+latencia de cada sentencia de la BD (claim_pass_position, upsert_grade, ...).
+
+Uso:
+    python loadtest.py --exam-file Examen-Modelo-01.py --students 120 --ramp 30
+    python loadtest.py --students 40 --secret WRITE_BEHIND=true --secret DB_POOL_SIZE=16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tomllib
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.asyncio.client import connect
+
+import exam_runner
+from db_schema import apply_migrations
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(HERE, "microlms.py")
+ID_LABEL = re.compile(r"c[ée]dula|\bid\b|identidad", re.IGNORECASE)
+LOGIN_LABEL = re.compile(r"iniciar|ingresar|entrar|acceder", re.IGNORECASE)
+SUBMIT_LABEL = re.compile(r"enviar", re.IGNORECASE)
+
+
+class Results:
+    """Latencias por tipo de rerun, contadores y errores."""
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.errors = []
+
+    def add(self, kind, seconds):
+        self.latencies[kind].append(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def error(self, student_id, message):
+        self.errors.append(f"{student_id}: {message}")
+
+
+def exam_id_filter(exam_id):
+    """
+    WHERE para el examen y sus secciones: plantillas como Examen-Modelo-01
+    guardan las notas bajo f"{EXAM_ID}_{seccion}", no bajo el ID a secas.
+    """
+    pattern = exam_id.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "\\_%"
+    return "(exam_id = ? OR exam_id LIKE ? ESCAPE '\\')", (exam_id, pattern)
+
+
+def flatten_answers(result):
+    """Valores numéricos de la solución en orden (dicts por inserción, listas aplanadas)."""
+    values = []
+
+    def walk(v):
+        if isinstance(v, dict):
+            for x in v.values():
+                walk(x)
+        elif isinstance(v, (list, tuple)):
+            for x in v:
+                walk(x)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            values.append(float(v))
+
+    for var in exam_runner.PRIORITY_VARS:
+        if var in result["priority"]:
+            walk(result["priority"][var])
+            if values:
+                break
+    return values
+
+
+# ==============================================================================
+# SECRETOS Y SERVIDOR
+# ==============================================================================
+
+def parse_secret(item):
+    """
+    "CLAVE=VALOR" de la línea de comandos. VALOR se lee como literal TOML (true,
+    16, 0.5, "texto"), igual que en secrets.toml; si no lo es, queda como texto.
+    """
+    key, _, value = item.partition("=")
+    try:
+        return key.strip(), tomllib.loads(f"v = {value}")["v"]
+    except tomllib.TOMLDecodeError:
+        return key.strip(), value
+
+
+def write_secrets(path, secrets):
+    """secrets.toml plano con los tipos de cada valor (un bool queda como true/false, no como texto)."""
+    lines = []
+    for key, value in secrets.items():
+        if isinstance(value, bool):
+            literal = "true" if value else "false"
+        elif isinstance(value, (int, float)):
+            literal = repr(value)
+        else:
+            literal = json.dumps(str(value))  # Un string JSON es un string básico válido en TOML
+        lines.append(f"{key} = {literal}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, secrets_path, log_path, timeout):
+    """`streamlit run` en segundo plano; retorna el proceso cuando /_stcore/health responde."""
+    log = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_FILE,
+         "--server.headless", "true", "--server.port", str(port), "--server.address", "127.0.0.1",
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false",
+         "--secrets.files", secrets_path],
+        cwd=HERE, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar (ver {log_path})")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as r:
+                if r.status == 200:
+                    return proc
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"El servidor no respondió en {timeout:.0f} s (ver {log_path})")
+
+
+def stop_server(proc, timeout=30):
+    """SIGTERM: Streamlit cierra ordenadamente y corren los atexit (p. ej. vaciar el búfer de escritura)."""
+    proc.terminate()
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def prepare_database(args):
+    """Crea el esquema y guarda el examen en el SQLite local (antes de levantar el servidor)."""
+    if os.path.exists(args.db) and not args.keep_db:
+        os.remove(args.db)
+
+    with open(args.exam_file, encoding="utf-8") as f:
+        source = f.read()
+    conn = sqlite3.connect(args.db)
+    apply_migrations(conn)
+    conn.execute("INSERT OR REPLACE INTO exams (exam_id, source_code, created_at) VALUES (?, ?, ?)",
+                 (args.exam_id, source, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    where, params = exam_id_filter(args.exam_id)
+    conn.execute(f"DELETE FROM grades WHERE {where}", params)
+    conn.execute(f"DELETE FROM exam_stats WHERE {where}", params)
+    conn.commit()
+    conn.close()
+    return source
+
+
+# ==============================================================================
+# SESIÓN DE NAVEGADOR SIN NAVEGADOR (protocolo WebSocket de Streamlit)
+# ==============================================================================
+
+class BrowserSession:
+    """
+    Lo mínimo que hace el frontend: manda BackMsg.rerun_script con los valores
+    de todos los widgets y junta los elementos que llegan hasta script_finished.
+    Como el navegador, recuerda el último valor de cada widget y lo reenvía en
+    cada rerun; los botones (trigger) valen solo para el rerun en que se pulsan.
+    """
+    def __init__(self, url, query_string, timeout):
+        self.url = url
+        self.query_string = query_string
+        self.timeout = timeout
+        self.elements = []  # [(tipo, proto)] del último rerun, en orden de ejecución
+        self.values = {}   # id del widget -> WidgetState
+        self._ws = None
+
+    async def __aenter__(self):
+        self._ws = await connect(self.url, subprotocols=["streamlit"], max_size=None)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._ws.close()
+
+    def widgets(self, kind):
+        return [proto for k, proto in self.elements if k == kind]
+
+    def set_value(self, widget, field, value):
+        state = WidgetState(id=widget.id)
+        setattr(state, field, value)
+        self.values[widget.id] = state
+
+    async def rerun(self, trigger=None):
+        """Un rerun completo (incluidos los st.rerun() del script). Retorna los segundos que tardó."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        msg.rerun_script.widget_states.widgets.extend(self.values.values())
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=trigger.id, trigger_value=True))
+        t0 = time.perf_counter()
+        await self._ws.send(msg.SerializeToString())
+        await asyncio.wait_for(self._collect(), self.timeout)
+        return time.perf_counter() - t0
+
+    async def _collect(self):
+        self.elements = []
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await self._ws.recv())
+            kind = fwd.WhichOneof("type")
+            if kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element = fwd.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type == "exception":
+                    raise RuntimeError(element.exception.message)
+                self.elements.append((element_type, getattr(element, element_type)))
+            elif kind == "script_finished":
+                status = fwd.script_finished
+                if status == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    self.elements = []  # st.rerun(): el servidor vuelve a correr el script solo
+                    continue
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("la app no compila")
+                return
+
+
+async def timed_rerun(session, results, kind, trigger=None):
+    results.add(kind, await session.rerun(trigger))
+
+
+async def student_session(url, student_id, answers, args, results, rng, delay):
+    await asyncio.sleep(delay)
+    try:
+        async with BrowserSession(url, f"eval={args.exam_id}", args.timeout) as session:
+            await timed_rerun(session, results, "render")
+
+            # 1. Ingreso: cédula, selectores vacíos (p. ej. la sección) y botón de inicio de sesión
+            for _ in range(3):
+                if session.widgets("number_input"):
+                    break
+                for ti in session.widgets("text_input"):
+                    if ID_LABEL.search(ti.label):
+                        session.set_value(ti, "string_value", student_id)
+                for sb in session.widgets("selectbox"):
+                    if sb.options and sb.id not in session.values:
+                        session.set_value(sb, "string_value", sb.options[0])
+                login = [b for b in session.widgets("button") if LOGIN_LABEL.search(b.label)]
+                await timed_rerun(session, results, "render", login[0] if login else None)
+
+            if not session.widgets("number_input"):
+                results.error(student_id, "no apareció el formulario de respuestas")
+                return
+
+            # 2. Intentos: mezcla de respuestas correctas e incorrectas hasta aprobar
+            for _ in range(args.attempts):
+                correct = rng.random() >= args.wrong_ratio
+                for i, ni in enumerate(session.widgets("number_input")):
+                    value = answers[i] if i < len(answers) else 0.0
+                    if not correct:
+                        value = value + 1.0 + abs(value) * 0.5
+                    session.set_value(ni, "double_value", round(value, 6))
+                buttons = session.widgets("button")
+                submit = [b for b in buttons if SUBMIT_LABEL.search(b.label)] or buttons
+                if not submit:
+                    results.error(student_id, "no hay botón de envío")
+                    return
+                await timed_rerun(session, results, "submit", submit[-1])
+                results.count("envios")
+                results.count("envios_correctos" if correct else "envios_incorrectos")
+                if correct:
+                    break
+                if not session.widgets("number_input"):  # El examen ya no muestra el formulario
+                    break
+    except Exception as e:
+        results.error(student_id, f"{type(e).__name__}: {e}")
+
+
+async def run_students(url, student_ids, answers, args, results):
+    """Todas las sesiones en el mismo bucle; la rampa solo escalona cuándo entra cada una."""
+    step = args.ramp / (len(student_ids) - 1) if args.ramp and len(student_ids) > 1 else 0.0
+    await asyncio.gather(*(
+        student_session(url, sid, answers[sid], args, results, random.Random(args.seed + i), i * step)
+        for i, sid in enumerate(student_ids)
+    ))
+
+
+# ==============================================================================
+# MÉTRICAS DE LA BD (textfile de Prometheus del servidor)
+# ==============================================================================
+
+def histogram_quantiles(buckets, count, qs=(0.5, 0.95, 0.99)):
+    """Cuantiles aproximados (interpolación lineal dentro del bucket) de un histograma de Prometheus."""
+    out = []
+    for q in qs:
+        target, prev_bound, prev_cum = q * count, 0.0, 0
+        value = float("inf")
+        for bound, cum in buckets:
+            if cum >= target:
+                if bound == float("inf"):
+                    value = prev_bound
+                else:
+                    span = cum - prev_cum
+                    frac = (target - prev_cum) / span if span else 1.0
+                    value = prev_bound + (bound - prev_bound) * frac
+                break
+            prev_bound, prev_cum = bound, cum
+        out.append(value)
+    return out
+
+
+def read_prometheus_textfile(path):
+    """{sentencia: {"count", "sum", "errors", "rows", "buckets": [(le, acumulado)]}}"""
+    stats = defaultdict(lambda: {"buckets": [], "count": 0, "sum": 0.0, "errors": 0, "rows": 0})
+    pattern = re.compile(r'^(\w+)\{statement="([^"]+)"(?:,le="([^"]+)")?\} (\S+)$')
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            m = pattern.match(line.strip())
+            if not m:
+                continue
+            metric, name, le, value = m.groups()
+            entry = stats[name]
+            if metric.endswith("_bucket"):
+                entry["buckets"].append((float(le), int(value)))
+            elif metric.endswith("_count"):
+                entry["count"] = int(value)
+            elif metric.endswith("_sum"):
+                entry["sum"] = float(value)
+            elif metric.endswith("_errors_total"):
+                entry["errors"] = int(value)
+            elif metric.endswith("_rows_returned_total"):
+                entry["rows"] = int(value)
+    for entry in stats.values():
+        entry["buckets"].sort()
+    return dict(stats)
+
+
+def percentiles_ms(values):
+    arr = np.array(values) * 1000
+    return [float(np.percentile(arr, q)) for q in (50, 95, 99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de microlms con N estudiantes concurrentes.")
+    parser.add_argument("--exam-file", default=os.path.join(HERE, "Examen-Modelo-01.py"),
+                        help="Plantilla a cargar como examen")
+    parser.add_argument("--exam-id", default="LOADTEST")
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--attempts", type=int, default=3, help="Máximo de envíos por estudiante")
+    parser.add_argument("--wrong-ratio", type=float, default=0.5, help="Probabilidad de enviar una respuesta incorrecta")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Segundos para ir sumando estudiantes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Tiempo máximo por rerun")
+    parser.add_argument("--port", type=int, help="Puerto del servidor (por defecto, uno libre)")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "microlms_loadtest.db"))
+    parser.add_argument("--keep-db", action="store_true", help="No borrar la BD local antes de empezar")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--secret", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Secreto extra para la app, como literal TOML (p. ej. WRITE_BEHIND=true, DB_POOL_SIZE=16)")
+    parser.add_argument("--json", help="Guardar el resumen en este archivo JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="microlms_loadtest_")
+    prom_path = os.path.join(workdir, "metrics.prom")
+    secrets = {
+        "TURSO_DB_URL": args.db,
+        "TURSO_AUTH_TOKEN": "",
+        "ADMIN_PASSWORD": "loadtest",
+        "PROM_TEXTFILE_PATH": prom_path,
+        "PROM_TEXTFILE_INTERVAL": 1,
+    }
+    secrets.update(parse_secret(item) for item in args.secret)
+    secrets_path = os.path.join(workdir, "secrets.toml")
+    write_secrets(secrets_path, secrets)
+
+    source = prepare_database(args)
+
+    # Cédulas y respuestas correctas calculadas de antemano (fuera del tiempo medido)
+    rng = random.Random(args.seed)
+    student_ids = [str(rng.randint(10_000_000, 35_000_000)) for _ in range(args.students)]
+    code = compile(exam_runner.sanitize(source), f"<examen:{args.exam_id}>", "exec")
+    answers = {sid: flatten_answers(exam_runner.solve_for_student(code, args.exam_id, sid)) for sid in student_ids}
+
+    port = args.port or free_port()
+    log_path = os.path.join(workdir, "server.log")
+    server = start_server(port, secrets_path, log_path, args.timeout)
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    results = Results()
+    try:
+        # Un render de calentamiento: imports de la app, pool, migraciones y bytecode del examen
+        async def warm_up():
+            async with BrowserSession(url, f"eval={args.exam_id}", args.timeout) as session:
+                await session.rerun()
+        asyncio.run(warm_up())
+
+        t_start = time.perf_counter()
+        asyncio.run(run_students(url, student_ids, answers, args, results))
+        elapsed = time.perf_counter() - t_start
+
+        # Dejar que el exportador escriba una última vez
+        time.sleep(float(secrets["PROM_TEXTFILE_INTERVAL"]) + 0.5)
+        statements = read_prometheus_textfile(prom_path) if os.path.exists(prom_path) else {}
+    finally:
+        stop_server(server)
+
+    # Después de cerrar el servidor: con WRITE_BEHIND, el búfer se vacía al salir
+    conn = sqlite3.connect(args.db)
+    where, params = exam_id_filter(args.exam_id)
+    aprobados, intentos = conn.execute(
+        f"SELECT COALESCE(SUM(is_correct), 0), COALESCE(SUM(attempts), 0) FROM grades WHERE {where}",
+        params).fetchone()
+    conn.close()
+
+    summary = {
+        "students": args.students, "elapsed_s": elapsed,
+        "counters": dict(results.counters), "errors": results.errors,
+        "db_passed": aprobados, "db_failed_attempts": intentos,
+        "reruns": {}, "statements": {},
+    }
+
+    print(f"\n{args.students} estudiantes en un servidor · {elapsed:.1f} s · "
+          f"examen {args.exam_id} ({os.path.basename(args.exam_file)})")
+    print(f"{'rerun':<10}{'n':>7}{'por s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind in ("render", "submit"):
+        values = results.latencies.get(kind, [])
+        if not values:
+            continue
+        p50, p95, p99 = percentiles_ms(values)
+        summary["reruns"][kind] = {"n": len(values), "per_s": len(values) / elapsed, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+        print(f"{kind:<10}{len(values):>7}{len(values) / elapsed:>9.1f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+    if statements:
+        # Incluye las sentencias del calentamiento (pocas: una lectura del examen)
+        print(f"\n{'sentencia (BD)':<28}{'n':>7}{'err':>5}{'media ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name, entry in sorted(statements.items()):
+            if not entry["count"]:
+                continue
+            p50, p95, p99 = (v * 1000 for v in histogram_quantiles(entry["buckets"], entry["count"]))
+            mean = entry["sum"] / entry["count"] * 1000
+            summary["statements"][name] = {"n": entry["count"], "errors": entry["errors"], "mean_ms": mean,
+                                           "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+            print(f"{name:<28}{entry['count']:>7}{entry['errors']:>5}{mean:>10.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}")
+
+    c = results.counters
+    print(f"\nEnvíos: {c['envios']} ({c['envios_correctos']} correctos, {c['envios_incorrectos']} incorrectos) · "
+          f"aprobados en BD: {aprobados}")
+    if c["envios_correctos"] != aprobados:
+        print("⚠️  Los aprobados en BD no coinciden con los envíos correctos "
+              "(¿plantilla con otro formulario, o una respuesta que la app no aceptó?)")
+    if results.errors:
+        print(f"⚠️  {len(results.errors)} estudiantes con error, p. ej.: {results.errors[0]}")
+        print(f"   Log del servidor: {log_path}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
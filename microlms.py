@@ -1,11 +1,64 @@
 import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
 import libsql_experimental as libsql
 import pandas as pd
 import numpy as np
 import random
 from datetime import datetime, timedelta, timezone  # <--- SE AGREGARON LIBRERÍAS DE TIEMPO
-import types
-import scipy
+import hashlib
+import sys
+import ast
+import json
+import marshal
+import stat
+import threading
+import time
+import atexit
+import csv
+import gzip
+import cProfile
+import pstats
+import functools
+import inspect
+import os
+import tempfile
+from collections import OrderedDict, Counter, deque
+from contextlib import contextmanager, nullcontext
+import logging
+import exam_runner
+from db_schema import (
+    apply_migrations, audit_query_plans, grades_page_queries, dashboard_queries,
+    segment_query, QUERIES, GRADE_SORTS, DASHBOARD_SEGMENTS,
+)
+
+try:  # Opcional: solo hace falta para exportar el libro de notas en Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger("microlms")
+
+TRUE_VALUES = {"1", "true", "yes", "on", "si", "sí"}
+FALSE_VALUES = {"0", "false", "no", "off", ""}
+
+def secret_flag(name, default=False):
+    """
+    Lee un secreto booleano. TOML da True/False, pero en variables de entorno o
+    con comillas llega como texto: "false" o "0" no pueden contar como activado.
+    """
+    value = st.secrets.get(name, default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    logger.warning("Secreto %s=%r no es booleano; se usa %s", name, value, default)
+    return default
 
 # ==============================================================================
 # 1. CONFIGURACIÓN Y ESTILOS
@@ -49,6 +102,8 @@ st.markdown(ST_STYLE, unsafe_allow_html=True)
 
 DEFAULT_TEMPLATE = """# --- INICIO DE PLANTILLA ---
 # Variables inyectadas: st, pd, np, random, db, EXAM_ID, student_id (si ya fue ingresado)
+# cache("clave", funcion): calcula funcion() una vez por estudiante (datasets, CSV, soluciones)
+# scipy, plt, px, go, fpdf: disponibles sin importar (se cargan al primer uso)
 
 # 1. VALIDACIÓN
 student_id = st.text_input("Ingrese su Cédula / ID", max_chars=12).strip()
@@ -94,6 +149,24 @@ if st.button("Enviar"):
 # ==============================================================================
 # 2. CAPA DE DATOS (Turso / LibSQL)
 # ==============================================================================
+# Migraciones, QUERIES y el SQL dinámico viven en db_schema.py (importable sin Streamlit)
+
+@st.cache_resource
+def verify_query_plans():
+    """
+    Una vez por proceso, solo como aviso en el log. Lo que bloquea es la prueba
+    tests/test_query_plans.py: aquí el planificador es el del sqlite3 del
+    servidor sobre una BD vacía, y otra versión podría elegir otro plan sin que
+    eso justifique tumbar los exámenes en curso.
+    """
+    try:
+        problems = audit_query_plans()
+    except Exception as e:
+        logger.warning("No se pudo auditar los planes de consulta: %s", e)
+        return False
+    if problems:
+        logger.warning("Consultas sin índice en DatabaseManager:\n%s", "\n".join(problems))
+    return not problems
 
 # Función auxiliar para chequear si la conexión sigue viva
 def is_connection_active(conn):
@@ -105,55 +178,905 @@ def is_connection_active(conn):
         # Si falla (por stream not found u otro), devolvemos False
         return False
 
-# Usamos validate en lugar de (o junto con) ttl
-@st.cache_resource(validate=is_connection_active)
-def get_db_connection():
-    """
-    Crea una conexión persistente a Turso e inicializa las tablas UNA SOLA VEZ.
-    """
+def open_turso_connection():
+    """Abre una conexión NUEVA a Turso (sin caché ni migraciones)."""
     url = st.secrets["TURSO_DB_URL"]
     token = st.secrets["TURSO_AUTH_TOKEN"]
-    conn = libsql.connect(database=url, auth_token=token)
-    
-    # --- BLOQUE MOVIDO: Se ejecuta solo la primera vez que arranca el servidor ---
-    # Tabla de Notas (Grades)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS grades (
-            exam_id TEXT,
-            student_id TEXT,
-            attempts INTEGER DEFAULT 0,
-            score REAL DEFAULT 0,
-            is_correct BOOLEAN DEFAULT 0,
-            last_updated TIMESTAMP,
-            PRIMARY KEY (exam_id, student_id)
-        )
-    """)
+    return libsql.connect(database=url, auth_token=token)
+
+# ==============================================================================
+# SALUD DE LA CONEXIÓN (Lease + Heartbeat + Reconexión transparente)
+# ==============================================================================
+# Mensajes de libsql/Hrana que significan "esta conexión murió, abre otra"
+STALE_CONNECTION_ERRORS = (
+    "stream not found", "stream expired", "stream closed", "hrana",
+    "connection closed", "connection reset", "broken pipe",
+)
+
+def is_stale_connection_error(error):
+    message = str(error).lower()
+    return any(fragment in message for fragment in STALE_CONNECTION_ERRORS)
+
+WRITE_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+class LeasedConnection:
+    """
+    Envoltura de la conexión a Turso que se usa igual que la original.
+    En vez de validar con SELECT 1 en cada acceso, confía en la conexión durante
+    `lease` segundos desde su último uso exitoso; un hilo de fondo le hace ping
+    solo cuando lleva más tiempo ociosa (heartbeat) y la reemplaza si no responde.
+    Si una consulta real falla con "stream not found" o similar, reconecta y la
+    reintenta una vez, salvo que estuviéramos a mitad de una transacción.
+    """
+    def __init__(self, connect, lease=30.0, heartbeat=True):
+        self._connect = connect
+        self.lease = lease
+        self.reconnects = 0
+        self._lock = threading.RLock()
+        self._conn = connect()
+        self._in_transaction = False
+        self.last_ok = time.monotonic()
+        self._closed = threading.Event()
+        # Dentro de un pool, el pool hace el ping de las conexiones ociosas
+        if heartbeat:
+            threading.Thread(target=self._heartbeat_loop, name="db-heartbeat", daemon=True).start()
+
+    @property
+    def in_transaction(self):
+        return self._in_transaction
+
+    def execute(self, sql, params=()):
+        return self._call("execute", sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._call("executemany", sql, seq_of_params)
+
+    def commit(self):
+        try:
+            self._conn.commit()
+        finally:
+            self._in_transaction = False
+        self.last_ok = time.monotonic()
+
+    def rollback(self):
+        try:
+            self._conn.rollback()
+        finally:
+            self._in_transaction = False
+
+    def reconnect(self):
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = self._connect()
+            self._in_transaction = False
+            self.reconnects += 1
+            self.last_ok = time.monotonic()
+
+    def ping_if_idle(self):
+        """Heartbeat: solo toca la red si el lease venció y no hay transacción abierta."""
+        if self._in_transaction or time.monotonic() - self.last_ok < self.lease:
+            return
+        with self._lock:
+            if is_connection_active(self._conn):
+                self.last_ok = time.monotonic()
+            else:
+                self.reconnect()
+
+    def close(self):
+        self._closed.set()
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+    def _call(self, method, sql, params):
+        can_retry = not self._in_transaction
+        try:
+            result = getattr(self._conn, method)(sql, params)
+        except Exception as e:
+            if not is_stale_connection_error(e):
+                raise
+            # Conexión muerta: la reemplazamos. Si había una transacción en curso ya
+            # se perdió, así que no reintentamos a ciegas y dejamos subir el error.
+            self.reconnect()
+            if not can_retry:
+                raise
+            result = getattr(self._conn, method)(sql, params)
+
+        if sql.lstrip().split(None, 1)[0].upper() in WRITE_KEYWORDS:
+            self._in_transaction = True
+        self.last_ok = time.monotonic()
+        return result
+
+    def _heartbeat_loop(self):
+        while not self._closed.wait(self.lease / 2):
+            try:
+                self.ping_if_idle()
+            except Exception:
+                pass  # El próximo uso real reconectará
+
+# ==============================================================================
+# POOL DE CONEXIONES (Una conexión por hilo de Streamlit)
+# ==============================================================================
+class ConnectionPool:
+    """
+    Pool acotado de LeasedConnection. Cada hilo de script de Streamlit (uno por
+    sesión) toma SU propia conexión mientras dura una operación de
+    DatabaseManager, así dos alumnos ya no intercalan sentencias ni commits.
+    Es reentrante: si el mismo hilo vuelve a pedir, recibe la conexión que ya tiene.
+
+    - size: máximo de conexiones en uso a la vez (el resto espera turno).
+    - idle_timeout: segundos que una conexión puede quedar ociosa antes de cerrarse.
+    - stats(): espera acumulada/máxima para obtener conexión, en uso, ociosas.
+    """
+    def __init__(self, connect, size=8, idle_timeout=300.0, lease=30.0):
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.lease = lease
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []                 # [(LeasedConnection, devuelta_en)]
+        self._local = threading.local()
+        self._in_use = 0
+        self._created = 0
+        self._acquired = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._closed = threading.Event()
+        threading.Thread(target=self._maintenance_loop, name="db-pool", daemon=True).start()
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        started = time.monotonic()
+        self._slots.acquire()
+        waited = time.monotonic() - started
+        try:
+            conn = self._take_idle() or self._new_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                # Una operación que falló a mitad no debe contaminar al próximo hilo
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            with self._lock:
+                self._in_use -= 1
+                self._idle.append((conn, time.monotonic()))
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "created": self._created,
+                "acquired": self._acquired,
+                "wait_avg_ms": 1000 * self._wait_total / self._acquired if self._acquired else 0.0,
+                "wait_max_ms": 1000 * self._wait_max,
+            }
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def _take_idle(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()[0]  # La más reciente: la que tiene el stream más fresco
+        return None
+
+    def _new_connection(self):
+        conn = LeasedConnection(self._connect, lease=self.lease, heartbeat=False)
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def _maintenance_loop(self):
+        # Cierra las ociosas vencidas y le hace heartbeat al resto (fuera del lock)
+        while not self._closed.wait(self.lease / 2):
+            with self._lock:
+                idle, self._idle = self._idle, []
+            now = time.monotonic()
+            keep = []
+            for conn, returned_at in idle:
+                if now - returned_at > self.idle_timeout:
+                    conn.close()
+                    continue
+                try:
+                    conn.ping_if_idle()
+                    keep.append((conn, returned_at))
+                except Exception:
+                    conn.close()
+            with self._lock:
+                self._idle.extend(keep)
+                while len(self._idle) > self.size:
+                    self._idle.pop(0)[0].close()
+
+@st.cache_resource
+def get_connection_pool():
+    """
+    Pool de conexiones del proceso. Ajustable en st.secrets:
+        DB_POOL_SIZE = 8, DB_POOL_IDLE_TIMEOUT = 300, DB_LEASE_SECONDS = 30
+    Lleva el esquema a la última versión con la primera conexión.
+    """
+    verify_query_plans()
+    pool = ConnectionPool(
+        open_turso_connection,
+        size=int(st.secrets.get("DB_POOL_SIZE", 8)),
+        idle_timeout=float(st.secrets.get("DB_POOL_IDLE_TIMEOUT", 300)),
+        lease=float(st.secrets.get("DB_LEASE_SECONDS", 30)),
+    )
     
-    # Tabla de Exámenes (Source Code Storage)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS exams (
-            exam_id TEXT PRIMARY KEY,
-            source_code TEXT,
-            created_at TIMESTAMP
-        )
-    """)
-    conn.commit()
-    # -----------------------------------------------------------------------------
+    # Solo aplica los pasos pendientes (en una BD al día es un único SELECT)
+    with pool.connection() as conn:
+        apply_migrations(conn)
     
-    return conn
+    return pool
+
+# ==============================================================================
+# RÉPLICA EMBEBIDA (Lecturas locales, escrituras al primario)
+# ==============================================================================
+class ReplicaReader:
+    """
+    Archivo SQLite local que libsql mantiene sincronizado desde Turso.
+    DatabaseManager le manda las lecturas (disco en vez de red); las escrituras
+    siguen yendo al primario por el pool.
+
+    Una sola conexión (la de sync_url) sincroniza, siempre en su propio hilo:
+    cada `sync_interval` segundos y cuando se lo piden con request_sync. Con
+    `sync_on_write`, quien escribe espera a que termine una sincronización
+    pedida DESPUÉS de su commit (read-your-writes: un estudiante que acaba de
+    aprobar no vuelve a ver el examen abierto); los pedidos que llegan durante
+    una sincronización se juntan en la siguiente. Las lecturas usan conexiones
+    locales aparte, hasta `readers` a la vez, así que nunca esperan a la red.
+    """
+    def __init__(self, path, sync_url, auth_token, sync_interval=60.0, sync_on_write=True, readers=4,
+                 sync_timeout=10.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_on_write = sync_on_write
+        self.sync_timeout = sync_timeout
+        self.syncs = 0
+        self.last_sync = None
+        self.last_error = None
+        self._sync_lock = threading.Lock()
+        # Generaciones: cada pedido suma una; el hilo anota la última que dejó sincronizada
+        self._sync_cond = threading.Condition()
+        self._sync_requested = 0
+        self._sync_completed = 0
+        self._sync_conn = libsql.connect(path, sync_url=sync_url, auth_token=auth_token)
+        self.sync()  # La primera vez sí se espera: sin ella el archivo no tiene el esquema
+
+        # Una conexión libsql no se comparte entre hilos a la vez: un pequeño pool de lectoras
+        self._slots = threading.BoundedSemaphore(readers)
+        self._idle = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._sync_loop, name="db-replica-sync", daemon=True).start()
+
+    def _open_reader(self):
+        conn = libsql.connect(self.path)
+        conn.execute("PRAGMA busy_timeout = 5000")  # Si justo se están aplicando frames de una sync
+        return conn
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._open_reader()
+            try:
+                yield conn
+            except Exception:
+                conn.close()  # No se devuelve una conexión en estado dudoso
+                raise
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def sync(self):
+        """Sincroniza ya (bloquea al que llama). En las peticiones usar request_sync."""
+        with self._sync_lock:
+            self._sync_conn.sync()
+        self.syncs += 1
+        self.last_sync = time.monotonic()
+
+    def request_sync(self, wait=False, timeout=None):
+        """
+        Pide una sincronización al hilo de fondo. Con wait=True espera (hasta
+        `timeout` s) a que termine una que empezó después de este pedido.
+        Retorna False si se agotó la espera.
+        """
+        with self._sync_cond:
+            self._sync_requested += 1
+            target = self._sync_requested
+            self._sync_cond.notify_all()
+            if not wait:
+                return True
+            return self._sync_cond.wait_for(lambda: self._sync_completed >= target, timeout)
+
+    def _sync_loop(self):
+        while True:
+            with self._sync_cond:
+                # Sin intervalo (0) solo se sincroniza cuando lo piden las escrituras
+                self._sync_cond.wait_for(lambda: self._sync_requested > self._sync_completed,
+                                         self.sync_interval if self.sync_interval > 0 else None)
+                target = self._sync_requested
+            try:
+                self.sync()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)  # Se sigue leyendo lo último sincronizado
+            with self._sync_cond:
+                # También si falló: quien espera no se queda colgado (el error queda en last_error)
+                self._sync_completed = max(self._sync_completed, target)
+                self._sync_cond.notify_all()
+
+@st.cache_resource
+def get_replica():
+    """
+    Réplica embebida para lecturas. Solo existe si se configura en st.secrets:
+        TURSO_REPLICA_PATH = "replica.db"
+        TURSO_REPLICA_SYNC_SECONDS = 60       # opcional, 0 = solo al escribir
+        TURSO_REPLICA_SYNC_ON_WRITE = true    # opcional, quien escribe espera a ver su escritura
+        TURSO_REPLICA_SYNC_TIMEOUT = 10       # opcional, espera máxima de esa sincronización
+        TURSO_REPLICA_READERS = 4             # opcional, conexiones de lectura simultáneas
+    """
+    path = st.secrets.get("TURSO_REPLICA_PATH")
+    if not path:
+        return None
+    get_connection_pool()  # El primario ya migrado: la primera sync trae el esquema al día
+    return ReplicaReader(
+        path,
+        sync_url=st.secrets["TURSO_DB_URL"],
+        auth_token=st.secrets["TURSO_AUTH_TOKEN"],
+        sync_interval=float(st.secrets.get("TURSO_REPLICA_SYNC_SECONDS", 60)),
+        sync_on_write=secret_flag("TURSO_REPLICA_SYNC_ON_WRITE", True),
+        readers=int(st.secrets.get("TURSO_REPLICA_READERS", 4)),
+        sync_timeout=float(st.secrets.get("TURSO_REPLICA_SYNC_TIMEOUT", 10)),
+    )
+
+# ==============================================================================
+# MÉTRICAS DE LA BD (Latencia por sentencia + exportador textfile de Prometheus)
+# ==============================================================================
+class DBMetrics:
+    """
+    Histograma de latencia, errores y filas devueltas por nombre de sentencia
+    (los nombres de QUERIES). Todo en memoria del proceso; write_textfile() lo
+    vuelca en formato de texto de Prometheus para el textfile collector de
+    node_exporter.
+    """
+    # Segundos. Turso remoto suele andar entre 20 y 200 ms; lo local, por debajo de 5 ms
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # nombre -> {"buckets": [...], "count", "sum", "errors", "rows"}
+        self.last_error = None
+
+    def record(self, name, seconds, rows=0, error=False):
+        with self._lock:
+            entry = self._stats.get(name)
+            if entry is None:
+                entry = self._stats[name] = {"buckets": [0] * len(self.BUCKETS), "count": 0,
+                                             "sum": 0.0, "errors": 0, "rows": 0}
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+                    break
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["rows"] += rows
+            if error:
+                entry["errors"] += 1
+
+    @contextmanager
+    def timed(self, name, rows=0):
+        """Para sentencias que no devuelven filas (executemany, commit)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(name, time.perf_counter() - t0, error=True)
+            raise
+        self.record(name, time.perf_counter() - t0, rows)
+
+    def snapshot(self):
+        """Una fila por sentencia con el p95 aproximado (límite del bucket que lo contiene)."""
+        with self._lock:
+            items = [(name, dict(v, buckets=list(v["buckets"]))) for name, v in self._stats.items()]
+        rows = []
+        for name, v in sorted(items):
+            p95, seen = float("inf"), 0
+            for bound, n in zip(self.BUCKETS, v["buckets"]):
+                seen += n
+                if seen >= 0.95 * v["count"]:
+                    p95 = bound
+                    break
+            rows.append({"sentencia": name, "llamadas": v["count"], "errores": v["errors"], "filas": v["rows"],
+                         "media_ms": v["sum"] / v["count"] * 1000 if v["count"] else 0.0, "p95_ms": p95 * 1000})
+        return rows
+
+    def render(self):
+        """Formato de exposición de texto de Prometheus."""
+        with self._lock:
+            items = sorted((name, dict(v, buckets=list(v["buckets"]))) for name, v in self._stats.items())
+        out = [
+            "# HELP microlms_db_statement_duration_seconds Latencia de las sentencias de DatabaseManager.",
+            "# TYPE microlms_db_statement_duration_seconds histogram",
+        ]
+        for name, v in items:
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS, v["buckets"]):
+                cumulative += n
+                out.append(f'microlms_db_statement_duration_seconds_bucket{{statement="{name}",le="{bound}"}} {cumulative}')
+            out.append(f'microlms_db_statement_duration_seconds_bucket{{statement="{name}",le="+Inf"}} {v["count"]}')
+            out.append(f'microlms_db_statement_duration_seconds_sum{{statement="{name}"}} {v["sum"]:.6f}')
+            out.append(f'microlms_db_statement_duration_seconds_count{{statement="{name}"}} {v["count"]}')
+        out += [
+            "# HELP microlms_db_statement_errors_total Sentencias que terminaron en excepción.",
+            "# TYPE microlms_db_statement_errors_total counter",
+        ]
+        out += [f'microlms_db_statement_errors_total{{statement="{name}"}} {v["errors"]}' for name, v in items]
+        out += [
+            "# HELP microlms_db_rows_returned_total Filas devueltas por las sentencias.",
+            "# TYPE microlms_db_rows_returned_total counter",
+        ]
+        out += [f'microlms_db_rows_returned_total{{statement="{name}"}} {v["rows"]}' for name, v in items]
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, path):
+        """Escritura atómica (archivo temporal + rename): node_exporter nunca lee un archivo a medias."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".microlms_", suffix=".prom.tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def start_exporter(self, path, interval=15.0):
+        """Hilo de fondo que reescribe el textfile cada `interval` segundos (y una vez más al salir)."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_textfile(path)
+                except Exception as e:
+                    self.last_error = str(e)
+
+        threading.Thread(target=loop, name="prom-textfile", daemon=True).start()
+        atexit.register(lambda: self.write_textfile(path))
+
+class _FetchedResult:
+    """Resultado ya leído de un cursor: expone lo que usa DatabaseManager (fetchone/fetchall/description)."""
+    __slots__ = ("description", "_rows", "_pos")
+
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = rows
+        self._pos = 0
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchall(self):
+        rows, self._pos = self._rows[self._pos:], len(self._rows)
+        return rows
+
+@st.cache_resource
+def get_db_metrics():
+    """Métricas del proceso; si hay PROM_TEXTFILE_PATH se exportan periódicamente."""
+    metrics = DBMetrics()
+    path = st.secrets.get("PROM_TEXTFILE_PATH")
+    if path:
+        metrics.start_exporter(path, float(st.secrets.get("PROM_TEXTFILE_INTERVAL", 15)))
+    return metrics
+
+# ==============================================================================
+# ESCRITURA DIFERIDA DE INTENTOS (Write-behind con group commit)
+# ==============================================================================
+class AttemptBuffer:
+    """
+    Modo opcional para los picos de envíos (inicio y cierre de un examen).
+    El intento se califica al instante contra un estado en memoria y se encola;
+    un hilo de fondo confirma la cola en grupo, con UN solo commit, cada
+    `flush_interval` segundos o apenas se juntan `max_batch` filas.
+
+    Mientras un alumno tenga filas pendientes, la memoria del proceso es la
+    fuente de verdad de sus intentos/nota y del contador de aprobados del examen.
+    Por eso este modo es para despliegues de UNA sola instancia del servidor.
+    """
+    def __init__(self, connect, flush_interval=0.2, max_batch=50, max_students=5000, metrics=None,
+                 max_retries=50):
+        self._connect = connect
+        self._conn = None
+        self.metrics = metrics or DBMetrics()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_students = max_students
+        self.max_retries = max_retries
+        self.last_error = None
+        self._failures = 0                # Lotes fallidos seguidos (con la BD alcanzable)
+        self.dead_letter = deque(maxlen=1000)  # Filas descartadas, para revisarlas a mano
+        # RLock: score_func (código de la plantilla) puede volver a llamar a db.*
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._queue = []                  # [(fila para upsert_grade_batch, reclamó_puesto)]
+        self._students = OrderedDict()    # (exam_id, student_id) -> estado vigente
+        self._passed = {}                 # exam_id -> aprobados (BD + pendientes)
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop, name="attempt-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def knows(self, exam_id, student_id):
+        with self._lock:
+            return (exam_id, student_id) in self._students and exam_id in self._passed
+
+    def load(self, exam_id, student_id, db_state):
+        """Guarda el estado leído de la BD si nadie lo cargó antes (el primero gana)."""
+        attempts, is_correct, score, passed_count = db_state
+        with self._lock:
+            self._passed.setdefault(exam_id, passed_count or 0)
+            self._students.setdefault((exam_id, student_id), {
+                "attempts": attempts or 0,
+                "passed": bool(is_correct),
+                "score": score or 0,
+                "queued": 0,
+            })
+            self._trim()
+
+    def status(self, exam_id, student_id):
+        """Estado en memoria del alumno, o None si hay que preguntarle a la BD."""
+        with self._lock:
+            state = self._students.get((exam_id, student_id))
+            return dict(state) if state else None
+
+    def submit(self, exam_id, student_id, is_correct, score_fn, timestamp):
+        """
+        Califica y encola un intento. score_fn(prev_failures, passed_count) recibe
+        los mismos datos que en el camino directo. Retorna (intentos, nota guardada).
+        """
+        with self._lock:
+            key = (exam_id, student_id)
+            state = self._students[key]
+            self._students.move_to_end(key)
+            claims = is_correct and not state["passed"]
+            score = score_fn(state["attempts"], self._passed[exam_id])  # Si falla, no se encola nada
+
+            # Misma lógica de preservación que upsert_grade
+            increment = 0 if is_correct else 1
+            state["attempts"] += increment
+            if is_correct or not state["passed"]:
+                state["score"] = score
+            state["passed"] = state["passed"] or bool(is_correct)
+            state["queued"] += 1
+            if claims:
+                self._passed[exam_id] += 1
+
+            self._queue.append(((exam_id, student_id, increment, is_correct, score, timestamp), claims))
+            if len(self._queue) >= self.max_batch:
+                self._wake.set()
+            return state["attempts"], float(state["score"])
+
+    def flush(self):
+        """
+        Confirma todo lo encolado en una sola transacción. Retorna filas escritas.
+
+        Si el mismo lote falla `max_retries` veces seguidas, se escribe fila por
+        fila y la que vuelva a fallar se aparta en dead_letter (con su entrada
+        en el log y en las métricas) para que no bloquee al resto de la cola.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._queue)
+            if not batch:
+                return 0
+
+            # Sin conexión no se cuenta como fallo del lote: es la BD la que no está
+            self._ensure_conn()
+            try:
+                self._write(batch)
+                self._failures = 0
+                written = batch
+            except Exception:
+                self._failures += 1
+                if self._failures < self.max_retries:
+                    raise  # La cola queda intacta; se reintenta en la próxima vuelta
+                self._failures = 0
+                written = self._write_one_by_one(batch)
+
+            self._dequeue(batch)
+            return len(written)
+
+    def _ensure_conn(self):
+        if self._conn is None:
+            self._conn = self._connect()
+
+    def _write(self, batch):
+        """Un lote, una transacción. Si falla, deshace y descarta la conexión."""
+        try:
+            self._ensure_conn()
+            with self.metrics.timed("upsert_grade_batch"):
+                self._conn.executemany(QUERIES["upsert_grade_batch"], [row for row, _ in batch])
+            passes = Counter(row[0] for row, claims in batch if claims)
+            if passes:
+                with self.metrics.timed("add_pass_positions"):
+                    self._conn.executemany(QUERIES["add_pass_positions"], list(passes.items()))
+            with self.metrics.timed("commit"):
+                self._conn.commit()
+        except Exception:
+            try:
+                self._conn.rollback()
+            except Exception:
+                pass
+            self._conn = None
+            raise
+
+    def _write_one_by_one(self, batch):
+        """Aísla las filas que hacen fallar el lote. Retorna las que sí se escribieron."""
+        written = []
+        for i, item in enumerate(batch):
+            try:
+                self._ensure_conn()
+            except Exception:
+                # Se cayó la conexión a mitad: lo ya resuelto sale de la cola, el resto espera
+                self._dequeue(batch[:i])
+                raise
+            try:
+                self._write([item])
+                written.append(item)
+            except Exception as e:
+                row, claims = item
+                self.dead_letter.append((row, claims, str(e)))
+                self.metrics.record("write_behind_dead_letter", 0.0, rows=1, error=True)
+                logger.error("Escritura diferida: fila descartada tras %d reintentos %r: %s",
+                             self.max_retries, row, e)
+        return written
+
+    def _dequeue(self, items):
+        """Saca de la cola las primeras len(items) filas (ya escritas o descartadas)."""
+        with self._lock:
+            del self._queue[:len(items)]
+            for (exam_id, student_id, *_), _ in items:
+                self._students[(exam_id, student_id)]["queued"] -= 1
+            self._trim()
+
+    def close(self):
+        """Vacía la cola antes de que el proceso termine (registrado en atexit)."""
+        self._closed = True
+        self._wake.set()
+        for _ in range(3):
+            try:
+                self.flush()
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                time.sleep(self.flush_interval)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+
+    def _trim(self):
+        """Olvida a los alumnos más antiguos SIN filas pendientes (la BD ya los tiene)."""
+        excess = len(self._students) - self.max_students
+        if excess > 0:
+            idle = [key for key, state in self._students.items() if state["queued"] == 0]
+            for key in idle[:excess]:
+                del self._students[key]
+
+@st.cache_resource
+def get_attempt_buffer():
+    """
+    Búfer de escritura diferida. Solo existe si se activa en st.secrets:
+        WRITE_BEHIND = true
+        WRITE_BEHIND_INTERVAL_MS = 200   # opcional
+        WRITE_BEHIND_MAX_BATCH = 50      # opcional
+        WRITE_BEHIND_MAX_RETRIES = 50    # opcional: reintentos de un lote antes de aislar filas
+    """
+    if not secret_flag("WRITE_BEHIND"):
+        return None
+    return AttemptBuffer(
+        open_turso_connection,
+        flush_interval=float(st.secrets.get("WRITE_BEHIND_INTERVAL_MS", 200)) / 1000,
+        max_batch=int(st.secrets.get("WRITE_BEHIND_MAX_BATCH", 50)),
+        metrics=get_db_metrics(),
+        max_retries=int(st.secrets.get("WRITE_BEHIND_MAX_RETRIES", 50)),
+    )
+
+# ==============================================================================
+# EXPORTACIÓN DEL LIBRO DE NOTAS (Bajo demanda, por bloques, a un archivo temporal)
+# ==============================================================================
+# formato -> (extensión, mime)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+# Columnas exportadas y su tipo en Parquet (fijo: SQLite puede devolver una nota
+# entera (15) o real (15.5) según la fila)
+EXPORT_COLUMNS = {
+    "exam_id": "string", "student_id": "string", "attempts": "int64",
+    "score": "float64", "is_correct": "int64", "last_updated": "string",
+}
+
+EXPORT_PREFIX = "notas_ve_"
+EXPORT_MAX_AGE = 6 * 3600  # Segundos: una exportación más vieja ya no la va a bajar nadie
+
+def remove_stale_exports(max_age=EXPORT_MAX_AGE):
+    """
+    Borra del directorio temporal las exportaciones abandonadas (generadas y
+    nunca descargadas, o de una sesión que se cerró). Retorna cuántas borró.
+    """
+    tmp = tempfile.gettempdir()
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(tmp):
+        if not name.startswith(EXPORT_PREFIX):
+            continue
+        path = os.path.join(tmp, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass  # Ya la borró otra sesión, o es de otro usuario
+    return removed
+
+def discard_grades_export():
+    """
+    Callback del botón de descarga: Streamlit ya tiene los bytes en memoria, así
+    que el archivo se borra y la exportación deja de servirse en los reruns.
+    """
+    export = st.session_state.pop("grades_export", None)
+    if export and os.path.exists(export["path"]):
+        os.remove(export["path"])
+
+def export_gradebook(fmt="csv", chunk_size=5000):
+    """
+    Escribe el libro de notas completo en un archivo temporal, bloque a bloque,
+    sin armar nunca un DataFrame con todas las filas. Retorna la ruta; quien la
+    pide es responsable de borrarla.
+    """
+    ext, _ = EXPORT_FORMATS[fmt]
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("Exportar en Parquet requiere instalar pyarrow.")
+
+    remove_stale_exports()
+    fd, path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=ext)
+    os.close(fd)
+    chunks = db_manager.iter_grade_chunks(chunk_size)
+    try:
+        if fmt == "parquet":
+            schema = pa.schema([(c, getattr(pa, t)()) for c, t in EXPORT_COLUMNS.items()])
+            with pq.ParquetWriter(path, schema) as writer:
+                for cols, rows in chunks:
+                    data = {c: [r[i] for r in rows] for i, c in enumerate(cols)}
+                    writer.write_table(pa.Table.from_pydict(data, schema=schema))
+        else:
+            opener = gzip.open if fmt == "csv.gz" else open
+            with opener(path, "wt", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                header_written = False
+                for cols, rows in chunks:
+                    if not header_written:
+                        writer.writerow(cols)
+                        header_written = True
+                    writer.writerows(rows)
+                if not header_written:
+                    writer.writerow(list(EXPORT_COLUMNS))
+    except Exception:
+        os.remove(path)
+        raise
+    return path
 
-@st.cache_data(ttl=60)  # <--- Cachear por 1 minuto
-def get_cached_all_grades():
-    # Usamos el manager global
-    return db_manager.get_all_grades()
+@st.cache_data(ttl=60, show_spinner=False)
+def get_cached_grade_exam_ids():
+    return db_manager.get_grade_exam_ids()
+
+# El filtro llega como tupla ordenada para que la misma selección reutilice la caché
+@st.cache_data(ttl=60, show_spinner=False)
+def get_cached_dashboard_summary(exam_ids):
+    return db_manager.get_dashboard_summary(list(exam_ids))
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_cached_segment_members(exam_ids, segment):
+    return db_manager.get_segment_members(list(exam_ids), segment)
 
 class DatabaseManager:
     def __init__(self):
         # Ya no hace falta inicializar la DB aquí, se hace en la conexión
         pass
 
-    def _get_conn(self):
-        return get_db_connection()
+    def _connection(self):
+        """Conexión propia del hilo actual, tomada del pool (usar con `with`)."""
+        return get_connection_pool().connection()
+
+    def _read_connection(self):
+        """Para lecturas sueltas: la réplica local si está configurada, si no el pool."""
+        replica = get_replica()
+        if replica is not None:
+            return replica.connection()
+        return self._connection()
+
+    def _after_write(self):
+        """
+        Read-your-writes: espera a que la réplica traiga lo que se acaba de
+        confirmar. Solo espera quien escribió; las lecturas de los demás siguen
+        por sus propias conexiones, y varias escrituras seguidas comparten una
+        sola sincronización.
+        """
+        replica = get_replica()
+        if replica is not None and replica.sync_on_write:
+            if not replica.request_sync(wait=True, timeout=replica.sync_timeout):
+                replica.last_error = "La réplica no se sincronizó a tiempo tras una escritura"
+
+    def _run(self, conn, name, params=(), sql=None):
+        """
+        Ejecuta una consulta por su nombre (de QUERIES, o `sql` si es dinámica).
+        Lee todas las filas aquí para que la latencia medida incluya el viaje
+        completo a la BD y se sepa cuántas filas devolvió.
+        """
+        metrics = get_db_metrics()
+        t0 = time.perf_counter()
+        try:
+            cursor = conn.execute(sql if sql is not None else QUERIES[name], params)
+            rows = cursor.fetchall() if cursor.description else []
+        except Exception:
+            metrics.record(name, time.perf_counter() - t0, error=True)
+            raise
+        metrics.record(name, time.perf_counter() - t0, len(rows))
+        return _FetchedResult(cursor.description, rows)
+
+    def _commit(self, conn):
+        with get_db_metrics().timed("commit"):
+            conn.commit()
 
     def _get_ve_time(self):
         """Retorna la hora actual en UTC-4 (Venezuela) en formato string SQL"""
@@ -163,27 +1086,75 @@ class DatabaseManager:
 
     # --- MÉTODOS DE ESTUDIANTE ---
     def check_student_status(self, exam_id: str, student_id: str):
-        conn = self._get_conn()
-        row = conn.execute(
-            "SELECT score FROM grades WHERE exam_id=? AND student_id=? AND is_correct=1", 
-            (exam_id, student_id)
-        ).fetchone()
-        if row:
-            return {"has_passed": True, "score": row[0]}
-        return {"has_passed": False, "score": 0}
+        # Con escritura diferida, un aprobado reciente puede no estar en la BD aún
+        buffer = get_attempt_buffer()
+        if buffer is not None:
+            state = buffer.status(exam_id, student_id)
+            if state is not None:
+                if state["passed"]:
+                    return {"has_passed": True, "score": state["score"]}
+                return {"has_passed": False, "score": 0}
+
+        with self._read_connection() as conn:
+            row = self._run(conn, "check_student_status", (exam_id, student_id)).fetchone()
+            if row:
+                return {"has_passed": True, "score": row[0]}
+            return {"has_passed": False, "score": 0}
 
     def register_attempt(self, exam_id: str, student_id: str, is_correct: bool, score_func=None):
-        conn = self._get_conn()
+        buffer = get_attempt_buffer()
+        if buffer is not None:
+            return self._register_attempt_buffered(buffer, exam_id, student_id, is_correct, score_func)
+
+        with self._connection() as conn:
+            prev_failures = 0
+            passed_count = 0
+        
+            # 1 y 2. Fallos previos + Factor Z (puesto de llegada entre los aprobados).
+            # Solo hacen falta si aprobó: la nota de un reprobado no depende de ellos,
+            # así que un intento fallido va directo al upsert (un único viaje a Turso).
+            if is_correct:
+                # Reclamamos el puesto incrementando el contador del examen: es atómico,
+                # O(1) y dos alumnos que aprueban en el mismo instante reciben puestos
+                # distintos. Si el alumno ya había aprobado no se consume un puesto.
+                res = self._run(conn, "claim_pass_position",
+                                (exam_id, exam_id, student_id, exam_id, student_id)).fetchone()
+            
+                if res:
+                    passed_count = res[0] - 1  # Aprobados ANTES que él
+                    prev_failures = res[1] or 0
+                else:
+                    # Ya estaba aprobado (reenvío): sin puesto nuevo
+                    res = self._run(conn, "get_passed_student", (exam_id, exam_id, student_id)).fetchone()
+                    prev_failures = res[0] or 0
+                    passed_count = res[1] or 0
         
-        # 1. Fallos previos
-        res_fail = conn.execute("SELECT attempts FROM grades WHERE exam_id=? AND student_id=?", (exam_id, student_id)).fetchone()
-        prev_failures = res_fail[0] if res_fail else 0
+            # 3. Cálculo de Nota
+            try:
+                score = self._compute_score(student_id, is_correct, prev_failures, passed_count, score_func)
+            except Exception:
+                # Liberamos el puesto reclamado si la plantilla falla
+                conn.rollback()
+                raise
+            
+            # 4. Upsert con HORA VENEZUELA y Lógica de Preservación
+            increment = 0 if is_correct else 1
+            current_time_ve = self._get_ve_time() 
         
-        # 2. Factor Z (Aprobados globales)
-        res_pass = conn.execute("SELECT COUNT(*) FROM grades WHERE exam_id=? AND is_correct=1", (exam_id,)).fetchone()
-        passed_count = res_pass[0] if res_pass else 0
+            try:
+                row = self._run(conn, "upsert_grade",
+                                (exam_id, student_id, increment, is_correct, score, current_time_ve)).fetchone()
+                self._commit(conn)
+            except Exception:
+                # El puesto reclamado y la nota se confirman juntos o no se confirman
+                conn.rollback()
+                raise
         
-        # 3. Cálculo de Nota
+        self._after_write()
+        return row[0], float(row[1])
+
+    def _compute_score(self, student_id, is_correct, prev_failures, passed_count, score_func=None):
+        """Nota de un intento: curva competitiva si aprobó, Gauss (0-9) si no."""
         score = 0
         if is_correct:
             # --- LÓGICA DE APROBADOS (10 a 20 pts) ---
@@ -221,92 +1192,735 @@ class DatabaseManager:
             nota_reprobado = rng.gauss(mu, sigma)
             score = max(0.0, min(9.0, nota_reprobado))
             
-        # 4. Upsert con HORA VENEZUELA y Lógica de Preservación
-        increment = 0 if is_correct else 1
-        current_time_ve = self._get_ve_time() 
-        
-        # NOTA SOBRE EL SQL:
-        # Hemos cambiado la lógica de "score =" para que:
-        # 1. Si el intento actual APROBÓ (excluded.is_correct), se guarde la nueva nota (10-20).
-        # 2. Si ya estaba APROBADO antes (grades.is_correct), se mantenga la nota vieja (no se puede bajar nota).
-        # 3. Si REPRUEBA (y no ha aprobado antes), se guarde la nota calculada por Gauss (0-9).
-        
-        conn.execute("""
-            INSERT INTO grades (exam_id, student_id, attempts, is_correct, score, last_updated)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(exam_id, student_id) DO UPDATE SET
-                attempts = attempts + excluded.attempts,
-                
-                -- Si ya aprobó alguna vez (grades.is_correct), se queda aprobado (MAX). 
-                -- Si no, toma el valor del intento actual.
-                is_correct = MAX(grades.is_correct, excluded.is_correct),
-                
-                score = CASE 
-                    WHEN excluded.is_correct THEN excluded.score  -- Nuevo aprobado: Actualizar nota
-                    WHEN grades.is_correct THEN grades.score      -- Ya aprobado antes: Mantener nota
-                    ELSE excluded.score                           -- Reprobado: Guardar nota Gaussiana (0-9)
-                END,
-                
-                last_updated = excluded.last_updated
-        """, (exam_id, student_id, increment, is_correct, score, current_time_ve))
-        conn.commit()
-        
-        return prev_failures + increment, score
+        return score
+
+    def _register_attempt_buffered(self, buffer, exam_id, student_id, is_correct, score_func):
+        """Camino de escritura diferida: sin viajes a Turso salvo la primera vez que vemos al alumno."""
+        if not buffer.knows(exam_id, student_id):
+            with self._connection() as conn:
+                db_state = self._run(conn, "get_attempt_state", (exam_id, student_id) * 3 + (exam_id,)).fetchone()
+                buffer.load(exam_id, student_id, db_state)
+
+        return buffer.submit(
+            exam_id, student_id, is_correct,
+            lambda prev_failures, passed_count: self._compute_score(
+                student_id, is_correct, prev_failures, passed_count, score_func),
+            self._get_ve_time()
+        )
 
-    def get_all_grades(self):
-        conn = self._get_conn()
-        cursor = conn.execute("SELECT * FROM grades ORDER BY last_updated DESC")
-        cols = [d[0] for d in cursor.description]
-        return pd.DataFrame(cursor.fetchall(), columns=cols)
+    def query_grades(self, exam_ids=None, id_prefix="", sort_by="last_updated", page=1, page_size=50):
+        """
+        Una página del libro de notas filtrada y ordenada en la BD.
+        Retorna (DataFrame de la página, total de filas que cumplen el filtro).
+        """
+        (count_sql, count_params), (page_sql, page_params) = grades_page_queries(
+            exam_ids, id_prefix, sort_by, page, page_size)
+        with self._read_connection() as conn:
+            total = self._run(conn, "query_grades_count", count_params, sql=count_sql).fetchone()[0]
+            cursor = self._run(conn, "query_grades_page", page_params, sql=page_sql)
+            cols = [d[0] for d in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=cols), total
+
+    def get_leaderboard(self, exam_id):
+        """Aprobados de un examen ya ordenados y numerados (rank, student_id, score, attempts)."""
+        with self._read_connection() as conn:
+            cursor = self._run(conn, "get_leaderboard", (exam_id,))
+            cols = [d[0] for d in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=cols)
+
+    def get_leaderboard_position(self, exam_id, student_id):
+        """(posición, nota, intentos) del estudiante en el ranking, o None si no ha aprobado."""
+        with self._read_connection() as conn:
+            return self._run(conn, "get_leaderboard_position", (exam_id, student_id)).fetchone()
+
+    def get_dashboard_summary(self, exam_ids=None):
+        """
+        Métricas del dashboard para los exámenes dados (todos si está vacío),
+        calculadas con GROUP BY en la BD. Retorna un dict con los KPIs, el conteo
+        por segmento y DataFrames pequeños para el histograma, la actividad diaria
+        y las burbujas de Esfuerzo vs. Nota.
+        """
+        queries = dashboard_queries(exam_ids)
+
+        def frame(conn, name):
+            sql, params = queries[name]
+            cursor = self._run(conn, name, params, sql=sql)
+            cols = [d[0] for d in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=cols)
+
+        with self._read_connection() as conn:
+            sql, params = queries["dashboard_kpis"]
+            k = self._run(conn, "dashboard_kpis", params, sql=sql).fetchone()
+            summary = {
+                "unicos": k[0], "aprobados": k[1], "registros": k[2],
+                "promedio_global": float(k[3] or 0),
+                "promedio_aprobados": float(k[4] or 0),
+                "promedio_intentos": float(k[5] or 0),
+                "total_puntos": float(k[6] or 0), "total_intentos": int(k[7] or 0),
+                "min_nota": float(k[8] or 0), "max_nota": float(k[9] or 0),
+                "segmentos": dict(zip(DASHBOARD_SEGMENTS, (int(v or 0) for v in k[10:13]))),
+            }
+            summary["histograma"] = frame(conn, "dashboard_histogram")
+            summary["actividad"] = frame(conn, "dashboard_activity")
+            summary["burbujas"] = frame(conn, "dashboard_bubbles")
+        return summary
+
+    def get_segment_members(self, exam_ids, segment):
+        """Filas de un segmento del informe (solo se piden cuando el docente abre la lista)."""
+        sql, params = segment_query(exam_ids, segment)
+        with self._read_connection() as conn:
+            cursor = self._run(conn, "dashboard_segment", params, sql=sql)
+            cols = [d[0] for d in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=cols)
+
+    def iter_grade_chunks(self, chunk_size=5000):
+        """
+        Recorre todo el libro de notas en bloques de `chunk_size` filas.
+        Genera (columnas, filas). Cada bloque usa su propia conexión, así una
+        descarga lenta no retiene una conexión del pool entre bloques.
+        """
+        last_key = ("", "")
+        while True:
+            with self._read_connection() as conn:
+                cursor = self._run(conn, "export_grades_chunk", last_key + (chunk_size,))
+                cols = [d[0] for d in cursor.description]
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield cols, rows
+            if len(rows) < chunk_size:
+                return
+            last_key = (rows[-1][0], rows[-1][1])
+
+    def get_grade_exam_ids(self):
+        """Exámenes (o examen_sección) que ya tienen notas, para los filtros."""
+        with self._read_connection() as conn:
+            return [r[0] for r in self._run(conn, "get_grade_exam_ids").fetchall()]
 
     # --- MÉTODOS DE GESTIÓN DE EXÁMENES (CMS) ---
     def get_exam_list(self):
-        conn = self._get_conn()
-        rows = conn.execute("SELECT exam_id FROM exams ORDER BY created_at DESC").fetchall()
-        return [r[0] for r in rows]
+        with self._read_connection() as conn:
+            rows = self._run(conn, "get_exam_list").fetchall()
+            return [r[0] for r in rows]
 
     def get_exam_code(self, exam_id):
-        conn = self._get_conn()
-        row = conn.execute("SELECT source_code FROM exams WHERE exam_id=?", (exam_id,)).fetchone()
-        return row[0] if row else None
-
-    def save_exam(self, exam_id, code):
-        conn = self._get_conn()
-        current_time_ve = self._get_ve_time() # Hora UTC-4
+        with self._read_connection() as conn:
+            row = self._run(conn, "get_exam_code", (exam_id,)).fetchone()
+            return row[0] if row else None
+
+    def get_exam_meta(self, exam_id):
+        """Huella y metadatos guardados con el código (None si se guardó antes de validarse)."""
+        with self._read_connection() as conn:
+            row = self._run(conn, "get_exam_meta", (exam_id,)).fetchone()
+        if not row or not row[0]:
+            return None
+        return {"source_hash": row[0], **json.loads(row[1] or "{}")}
+
+    def get_exam_version(self, exam_id):
+        """
+        (versión, huella) del examen, o None si no existe. La huella distingue un
+        examen borrado y vuelto a crear (su versión arranca otra vez en 1).
+        """
+        with self._read_connection() as conn:
+            row = self._run(conn, "get_exam_version", (exam_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save_exam(self, exam_id, code, code_hash=None, metadata=None):
+        with self._connection() as conn:
+            current_time_ve = self._get_ve_time() # Hora UTC-4
         
-        conn.execute("""
-            INSERT INTO exams (exam_id, source_code, created_at) VALUES (?, ?, ?)
-            ON CONFLICT(exam_id) DO UPDATE SET 
-                source_code = excluded.source_code,
-                created_at = excluded.created_at
-        """, (exam_id, code, current_time_ve))
-        conn.commit()
+            self._run(conn, "save_exam", (exam_id, code, current_time_ve, code_hash,
+                                          json.dumps(metadata) if metadata is not None else None))
+            self._commit(conn)
+        self._after_write()
 
     def delete_exam(self, exam_id):
-        conn = self._get_conn()
-        conn.execute("DELETE FROM exams WHERE exam_id=?", (exam_id,))
-        conn.commit()
+        with self._connection() as conn:
+            self._run(conn, "delete_exam", (exam_id,))
+            self._commit(conn)
+        self._after_write()
 
 db_manager = DatabaseManager()
 
 # --- INICIO NUEVO BLOQUE DE CACHÉ ---
-@st.cache_data(show_spinner=False, ttl=300) 
-def get_cached_exam_code(exam_id):
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=256) 
+def get_cached_exam_code(exam_id, version):
     """
-    Recupera el código del examen y lo guarda en memoria por 5 minutos (300 seg).
+    Recupera el código del examen y lo guarda en memoria, por (exam_id, versión).
     Si 30 estudiantes entran a la vez, solo la primera petición va a la BD.
     Las otras 29 se sirven instantáneamente desde la RAM.
+    Al editar el examen cambia la versión: la entrada vieja deja de pedirse y
+    vence sola, sin tocar las de los demás exámenes.
     """
     return db_manager.get_exam_code(exam_id)
 # --- FIN NUEVO BLOQUE DE CACHÉ ---
 
+# ==============================================================================
+# CACHÉ DE CÓDIGO COMPILADO (Bytecode compartido por todo el proceso)
+# ==============================================================================
+def source_hash(source_code):
+    """Huella del código fuente de un examen (cambia con cualquier edición)."""
+    return hashlib.sha256(source_code.encode("utf-8")).hexdigest()
+
+def compile_exam(exam_id, source_code):
+    """
+    Valida y compila una plantilla. Retorna (código compilado, metadatos).
+    Lanza SyntaxError (con lineno/offset/text) si el código no compila.
+    Los metadatos se guardan junto al código: nombres de primer nivel,
+    módulos importados y tamaño.
+    """
+    tree = ast.parse(source_code, f"<examen:{exam_id}>")
+    code = compile(tree, f"<examen:{exam_id}>", "exec")
+
+    names, imports = [], []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.append(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names.extend(n.id for t in targets for n in ast.walk(t) if isinstance(n, ast.Name))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            imports.append(node.module)
+
+    metadata = {
+        "size_bytes": len(source_code.encode("utf-8")),
+        "lines": source_code.count("\n") + 1,
+        "top_level_names": sorted(set(names)),
+        "imports": sorted(set(imports)),
+        "python": sys.implementation.cache_tag,
+    }
+    return code, metadata
+
+class CompiledExamCache:
+    """
+    Guarda los objetos de código ya compilados de cada examen (LRU).
+    La llave es (exam_id, hash del código fuente): si el profesor edita el examen
+    el hash cambia, la versión vieja deja de usarse y termina siendo expulsada.
+    Con artifact_dir, además se guardan en disco (marshal, uno por hash y versión
+    de Python): una instancia recién arrancada los carga sin volver a compilar.
+    marshal.load ejecuta lo que encuentre, así que el directorio tiene que ser
+    privado (ver _private_dir); si no lo es, se trabaja solo en memoria.
+    """
+    def __init__(self, max_entries=64, artifact_dir=None):
+        self.max_entries = max_entries
+        self.artifact_dir = self._private_dir(artifact_dir) if artifact_dir else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def _private_dir(path):
+        """
+        El directorio si es nuestro y nadie más puede escribir en él (se crea
+        con 0o700 si no existe); None si no. Un directorio que ya estaba en un
+        /tmp compartido podría ser de otro usuario con bytecode plantado.
+        """
+        getuid = getattr(os, "getuid", None)
+        if getuid is None:
+            logger.warning("Sin permisos POSIX para verificar %s: bytecode solo en memoria", path)
+            return None
+        try:
+            os.makedirs(path, mode=0o700)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            logger.warning("No se pudo crear %s (%s): bytecode solo en memoria", path, e)
+            return None
+        try:
+            info = os.lstat(path)
+        except OSError:
+            return None
+        if (not stat.S_ISDIR(info.st_mode) or info.st_uid != getuid()
+                or stat.S_IMODE(info.st_mode) & 0o077):
+            logger.warning("%s no es un directorio privado de este usuario (0o700): bytecode solo en memoria", path)
+            return None
+        return path
+
+    def _artifact_path(self, code_hash):
+        # marshal cambia entre versiones de Python: la versión va en el nombre
+        return os.path.join(self.artifact_dir, f"{code_hash}.{sys.implementation.cache_tag}.marshal")
+
+    def _load_artifact(self, code_hash):
+        if not self.artifact_dir:
+            return None
+        try:
+            with open(self._artifact_path(code_hash), "rb") as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None  # No existe o quedó a medias: se compila de nuevo
+
+    def _store_artifact(self, code_hash, code):
+        if not self.artifact_dir:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.artifact_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump(code, f)
+            os.replace(tmp_path, self._artifact_path(code_hash))  # Atómico: nadie lee un archivo a medias
+        except OSError:
+            pass  # Sin disco seguimos con la caché en memoria
+
+    def put(self, exam_id, code_hash, code):
+        """Registra un código ya compilado (al guardar el examen en el editor)."""
+        key = (exam_id, code_hash)
+        with self._lock:
+            self._entries[key] = code
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._store_artifact(code_hash, code)
+
+    def invalidate_exam(self, exam_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == exam_id]:
+                del self._entries[key]
+
+    def get(self, exam_id, source_code):
+        code_hash = source_hash(source_code)
+        key = (exam_id, code_hash)
+        with self._lock:
+            code = self._entries.get(key)
+            if code is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return code
+            self.misses += 1
+
+        # Compilamos (o leemos de disco) fuera del lock para no bloquear a los demás estudiantes
+        code = self._load_artifact(code_hash)
+        if code is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._entries[key] = code
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return code
+
+        code = compile(source_code, f"<examen:{exam_id}>", "exec")
+        self.put(exam_id, code_hash, code)
+        return code
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "disk_hits": self.disk_hits}
+
+@st.cache_resource
+def get_compiled_exam_cache():
+    """Una sola instancia por proceso (sobrevive a los reruns de Streamlit)."""
+    # Por defecto uno por usuario en el directorio temporal; igual se verifica que sea privado
+    default_dir = os.path.join(tempfile.gettempdir(), f"microlms-exams-{getattr(os, 'getuid', lambda: 'x')()}")
+    artifact_dir = st.secrets.get("EXAM_ARTIFACT_DIR", default_dir)
+    return CompiledExamCache(artifact_dir=artifact_dir or None)
+
+# ==============================================================================
+# CACHÉ DE RESULTADOS DEL SOLUCIONADOR (Reclamos de notas instantáneos)
+# ==============================================================================
+class SolverResultCache:
+    """
+    Recuerda lo que produjo el Solucionador para cada (hash del código, cédula),
+    en LRU acotado. Mismo código y misma cédula dan las mismas variables, así que
+    repetir una consulta no vuelve a ejecutar la plantilla (ni a generar sus
+    datasets). Al guardar o borrar un examen se descartan sus entradas.
+    """
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (source_hash, student_id) -> (exam_id, resultado)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source_hash, student_id):
+        key = (source_hash, str(student_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, exam_id, source_hash, result):
+        key = (source_hash, result["student_id"])
+        with self._lock:
+            self._entries[key] = (exam_id, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_exam(self, exam_id):
+        with self._lock:
+            for key in [k for k, (eid, _) in self._entries.items() if eid == exam_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+@st.cache_resource
+def get_solver_result_cache():
+    return SolverResultCache()
+
+# ==============================================================================
+# CACHÉ POR ESTUDIANTE PARA LAS PLANTILLAS (cache(clave, fn) en el contexto)
+# ==============================================================================
+def _approx_nbytes(value, depth=0):
+    """Tamaño aproximado en memoria (DataFrames y arrays por su buffer real)."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if depth < 3 and isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_approx_nbytes(k, depth + 1) + _approx_nbytes(v, depth + 1)
+                                          for k, v in value.items())
+    if depth < 3 and isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(_approx_nbytes(v, depth + 1) for v in value)
+    return sys.getsizeof(value)
+
+class ExamArtifactCache:
+    """
+    Artefactos que una plantilla genera por estudiante (dataset ruidoso, CSV,
+    vector de soluciones), guardados por (exam_id, hash del código, cédula,
+    clave) en LRU bajo un presupuesto total de bytes. Así se calculan una vez
+    por estudiante y no en cada tecla que dispara un rerun.
+    Lo devuelto es compartido entre reruns: la plantilla no debe modificarlo.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (exam_id, source_hash, student_id, key) -> (valor, bytes)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, scope, fn):
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is not None:
+                self._entries.move_to_end(scope)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Se calcula fuera del lock: la plantilla de un estudiante no frena a los demás
+        value = fn()
+        size = _approx_nbytes(value)
+        if size > self.max_bytes:
+            return value  # No cabe ni solo: se entrega sin guardar
+
+        with self._lock:
+            old = self._entries.pop(scope, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[scope] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted
+        return value
+
+    def bind(self, context, exam_id, code_hash):
+        """
+        La función `cache(clave, fn)` que ve la plantilla. La cédula se lee del
+        contexto al momento de llamarla (la plantilla la define al validar); si
+        todavía no hay cédula, fn() se ejecuta sin guardar nada.
+        """
+        def cache(key, fn):
+            student_id = context.get("student_id")
+            if not student_id:
+                return fn()
+            return self.get_or_compute((exam_id, code_hash, str(student_id), key), fn)
+        return cache
+
+    def invalidate_exam(self, exam_id):
+        with self._lock:
+            for scope in [k for k in self._entries if k[0] == exam_id]:
+                self.total_bytes -= self._entries.pop(scope)[1]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+@st.cache_resource
+def get_exam_artifact_cache():
+    return ExamArtifactCache(int(float(st.secrets.get("EXAM_CACHE_MB", 256)) * 1024 * 1024))
+
+# ==============================================================================
+# VERSIONES DE EXAMEN (Invalidación por examen, también entre procesos)
+# ==============================================================================
+class ExamVersionCache:
+    """
+    Última versión conocida de cada examen, revalidada con una consulta barata
+    (get_exam_version) como mucho cada `ttl` segundos. Si otro proceso guardó o
+    borró el examen, aquí se nota en la siguiente revalidación y on_change
+    descarta solo lo de ese examen en las cachés locales.
+    """
+    def __init__(self, fetch, ttl=5.0, on_change=None):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.on_change = on_change
+        self._entries = {}  # exam_id -> (versión, momento de la consulta)
+        self._lock = threading.Lock()
+        self.polls = 0
+
+    def get(self, exam_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(exam_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                return entry[0]
+
+        version = self._fetch(exam_id)
+        with self._lock:
+            previous = self._entries.get(exam_id)
+            self._entries[exam_id] = (version, now)
+            self.polls += 1
+        if previous is not None and previous[0] != version and self.on_change:
+            self.on_change(exam_id)
+        return version
+
+    def invalidate(self, exam_id):
+        with self._lock:
+            self._entries.pop(exam_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"exams": len(self._entries), "polls": self.polls, "ttl": self.ttl}
+
+def evict_exam_caches(exam_id):
+    """Descarta de las cachés de este proceso todo lo derivado del código de un examen."""
+    get_compiled_exam_cache().invalidate_exam(exam_id)
+    get_solver_result_cache().invalidate_exam(exam_id)
+    get_exam_artifact_cache().invalidate_exam(exam_id)
+
+def invalidate_exam_caches(exam_id):
+    """Tras guardar o borrar un examen en este proceso: efecto inmediato, sin esperar el ttl."""
+    get_exam_version_cache().invalidate(exam_id)
+    evict_exam_caches(exam_id)
+
+@st.cache_resource
+def get_exam_version_cache():
+    return ExamVersionCache(
+        db_manager.get_exam_version,
+        ttl=float(st.secrets.get("EXAM_VERSION_TTL", 5.0)),
+        on_change=evict_exam_caches,
+    )
+
+def load_exam_source(exam_id):
+    """Código vigente del examen, o None si no existe (p. ej. recién borrado)."""
+    version = get_exam_version_cache().get(exam_id)
+    if version is None:
+        return None
+    return get_cached_exam_code(exam_id, version)
+
+# ==============================================================================
+# PERFILADOR DE RENDERS (Opcional: muestrea una fracción de las ejecuciones)
+# ==============================================================================
+RENDER_PHASES = ("fetch", "exec", "db", "widgets")
+
+class RenderSample:
+    """
+    Tiempos de un render muestreado, por fase: reloj (perf_counter) y CPU del
+    hilo (thread_time). Solo cuenta la llamada más externa: si un widget llama
+    a otro código medido, el tiempo no se suma dos veces.
+    """
+    def __init__(self):
+        self.wall = dict.fromkeys(RENDER_PHASES, 0.0)
+        self.cpu = dict.fromkeys(RENDER_PHASES, 0.0)
+        self._depth = 0
+
+    @contextmanager
+    def timed(self, phase):
+        if self._depth:
+            yield
+            return
+        self._depth += 1
+        w0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.wall[phase] += time.perf_counter() - w0
+            self.cpu[phase] += time.thread_time() - c0
+            self._depth -= 1
+
+    def finish(self):
+        """El tiempo de exec incluye al de BD y widgets: se deja solo el propio de la plantilla."""
+        for totals in (self.wall, self.cpu):
+            totals["exec"] = max(0.0, totals["exec"] - totals["db"] - totals["widgets"])
+        return self
+
+class _PhaseProxy:
+    """
+    Envuelve a `st` o `db` para la plantilla y mide en una fase solo los métodos
+    de `owner` (widgets y elementos de un DeltaGenerator, o consultas de
+    DatabaseManager). Lo demás (st.cache_data, st.session_state, st.rerun...)
+    pasa tal cual. Los contenedores que devuelve (columns, form, sidebar...)
+    se envuelven también, para que sus widgets cuenten en la misma fase.
+    """
+    def __init__(self, target, sample, phase, owner):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_sample", sample)
+        object.__setattr__(self, "_phase", phase)
+        object.__setattr__(self, "_owner", owner)
+
+    def _wrap(self, value):
+        if isinstance(value, self._owner) and value is not self._target:
+            return _PhaseProxy(value, self._sample, self._phase, self._owner)
+        if isinstance(value, (list, tuple)) and value and all(isinstance(v, self._owner) for v in value):
+            return type(value)(self._wrap(v) for v in value)  # st.columns / st.tabs
+        return value
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not (inspect.ismethod(attr) and isinstance(attr.__self__, self._owner)):
+            return self._wrap(attr)  # st.sidebar se envuelve; st.cache_data, st.session_state... no
+        sample, phase, wrap = self._sample, self._phase, self._wrap
+
+        @functools.wraps(attr)
+        def timed(*args, **kwargs):
+            with sample.timed(phase):
+                return wrap(attr(*args, **kwargs))
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    # `with col:` / `with st.form(...):` buscan estos métodos en la clase, no en __getattr__
+    def __enter__(self):
+        self._target.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._target.__exit__(*exc)
+
+class RenderProfiler:
+    """
+    Guarda las últimas muestras de render por examen y, para cada examen, las
+    funciones más costosas según cProfile (acumuladas entre muestras).
+    Solo puede haber un cProfile activo por proceso: quien no consigue el lock
+    se muestrea igual, pero sin perfil de funciones.
+    """
+    def __init__(self, sample_rate=0.0, top_n=20, max_samples=500, use_cprofile=True):
+        self.sample_rate = sample_rate
+        self.top_n = top_n
+        self.max_samples = max_samples
+        self.use_cprofile = use_cprofile
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self._samples = {}    # exam_id -> deque de (wall por fase, cpu por fase)
+        self._functions = {}  # exam_id -> {función: [llamadas, tottime, cumtime]}
+
+    def maybe_sample(self):
+        """Un RenderSample para esta ejecución, o None si no le toca (casi siempre)."""
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return RenderSample()
+        return None
+
+    @contextmanager
+    def profiling(self, sample):
+        """Activa cProfile durante el bloque si esta muestra lo lleva y nadie más lo está usando."""
+        if sample is None or not self.use_cprofile or not self._cprofile_lock.acquire(blocking=False):
+            yield None
+            return
+        prof = cProfile.Profile()
+        try:
+            try:
+                prof.enable()
+            except ValueError:  # Otro perfilador/depurador ya está activo
+                prof = None
+            yield prof
+        finally:
+            if prof is not None:
+                prof.disable()
+            self._cprofile_lock.release()
+
+    def record(self, exam_id, sample, prof=None):
+        sample.finish()
+        functions = None
+        if prof is not None:
+            functions = {}
+            for (filename, line, func), (_, ncalls, tottime, cumtime, _) in pstats.Stats(prof).stats.items():
+                functions[f"{func} ({os.path.basename(filename)}:{line})"] = (ncalls, tottime, cumtime)
+        with self._lock:
+            samples = self._samples.setdefault(exam_id, deque(maxlen=self.max_samples))
+            samples.append((dict(sample.wall), dict(sample.cpu)))
+            if functions:
+                acc = self._functions.setdefault(exam_id, {})
+                for name, (ncalls, tottime, cumtime) in functions.items():
+                    row = acc.setdefault(name, [0, 0.0, 0.0])
+                    row[0] += ncalls
+                    row[1] += tottime
+                    row[2] += cumtime
+                # Acotado: se conserva un margen sobre el top-N para que el ranking sea estable
+                if len(acc) > self.top_n * 4:
+                    keep = sorted(acc.items(), key=lambda kv: kv[1][1], reverse=True)[:self.top_n * 4]
+                    self._functions[exam_id] = dict(keep)
+
+    def summary(self):
+        """Una fila por examen, ordenadas por p95 del tiempo total de render (ms)."""
+        with self._lock:
+            snapshot = {eid: list(samples) for eid, samples in self._samples.items()}
+        rows = []
+        for exam_id, samples in snapshot.items():
+            totals = np.array([sum(wall.values()) for wall, _ in samples]) * 1000
+            row = {
+                "exam_id": exam_id,
+                "muestras": len(samples),
+                "p50_ms": float(np.percentile(totals, 50)),
+                "p95_ms": float(np.percentile(totals, 95)),
+                "cpu_p50_ms": float(np.percentile([sum(cpu.values()) * 1000 for _, cpu in samples], 50)),
+            }
+            for phase in RENDER_PHASES:
+                row[f"{phase}_ms"] = float(np.mean([wall[phase] for wall, _ in samples]) * 1000)
+            rows.append(row)
+        df = pd.DataFrame(rows)
+        return df.sort_values("p95_ms", ascending=False, ignore_index=True) if not df.empty else df
+
+    def top_functions(self, exam_id):
+        with self._lock:
+            acc = dict(self._functions.get(exam_id, {}))
+        rows = [{"función": name, "llamadas": n, "tottime_ms": tt * 1000, "cumtime_ms": ct * 1000}
+                for name, (n, tt, ct) in acc.items()]
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return df
+        return df.sort_values("tottime_ms", ascending=False, ignore_index=True).head(self.top_n)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._functions.clear()
+
+@st.cache_resource
+def get_render_profiler():
+    """Desactivado por defecto (PROFILE_SAMPLE_RATE = 0); se puede ajustar desde el panel."""
+    return RenderProfiler(
+        sample_rate=float(st.secrets.get("PROFILE_SAMPLE_RATE", 0.0)),
+        top_n=int(st.secrets.get("PROFILE_TOP_N", 20)),
+        use_cprofile=secret_flag("PROFILE_CPROFILE", True),
+    )
+
 # ==============================================================================
 # 3. LÓGICA DE INTERFAZ (Admin vs Estudiante)
 # ==============================================================================
 
 def execute_exam(exam_id):
     """Carga el código desde BD y lo ejecuta en un entorno seguro"""
-    source_code = get_cached_exam_code(exam_id)
+    # Perfilado opcional: solo una fracción de los renders se mide (None = no medir)
+    profiler = get_render_profiler()
+    sample = profiler.maybe_sample()
+
+    with sample.timed("fetch") if sample else nullcontext():
+        source_code = load_exam_source(exam_id)
     #source_code = db_manager.get_exam_code(exam_id)
     
     if not source_code:
@@ -334,194 +1948,53 @@ def execute_exam(exam_id):
         'is_admin': is_admin_user,  # <--- NUEVA VARIABLE INYECTADA
         'sidebar_area': contenedor_teoria
     }
+    # scipy, plt, px, go, fpdf: proxies que importan el módulo al primer uso
+    context.update(exam_runner.lazy_modules())
+    # random/np propios de esta ejecución: los reruns concurrentes no comparten semilla
+    context.update(exam_runner.isolated_randomness(context, exam_id))
+    context['cache'] = get_exam_artifact_cache().bind(context, exam_id, source_hash(source_code))
+    if sample:
+        # En las ejecuciones muestreadas, la plantilla ve 'st' y 'db' medidos
+        context['st'] = _PhaseProxy(st, sample, "widgets", DeltaGenerator)
+        context['db'] = _PhaseProxy(db_manager, sample, "db", DatabaseManager)
+        context['sidebar_area'] = _PhaseProxy(contenedor_teoria, sample, "widgets", DeltaGenerator)
     
+    prof = None
     try:
-        exec(source_code, context)
+        # Los reruns reutilizan el bytecode: solo se compila la primera vez
+        compiled_code = get_compiled_exam_cache().get(exam_id, source_code)
+        with profiler.profiling(sample) as prof:
+            with sample.timed("exec") if sample else nullcontext():
+                exec(compiled_code, context)
     except Exception as e:
         st.error("🚨 Error interno en la ejecución del examen.")
         with st.expander("Detalles para el profesor"):
             st.code(str(e))
+    finally:
+        if sample:
+            profiler.record(exam_id, sample, prof)
 
 
 
 # ==============================================================================
-# CLASES AUXILIARES PARA EL SOLUCIONADOR (Agregar antes de render_admin_panel)
-# ==============================================================================
-
-# ==============================================================================
-# CLASES AUXILIARES (Actualizar esta sección al inicio del script)
-# ==============================================================================
-
-# ==============================================================================
-# REEMPLAZAR LA CLASE SilentStreamlit ANTIGUA POR ESTA VERSIÓN MEJORADA
-# ==============================================================================
-
-# ==============================================================================
-# CLASE MOCK SESSION STATE (Para soportar notación de punto .clave)
-# ==============================================================================
-class MockSessionState(dict):
-    """
-    Simula el comportamiento híbrido de st.session_state:
-    Funciona como diccionario (state['key']) y como objeto (state.key).
-    """
-    def __getattr__(self, key):
-        try:
-            return self[key]
-        except KeyError:
-            raise AttributeError(f"'MockSessionState' object has no attribute '{key}'")
-
-    def __setattr__(self, key, value):
-        self[key] = value
-
-# ==============================================================================
-# REEMPLAZAR LA CLASE SilentStreamlit POR ESTA VERSIÓN CORREGIDA
+# SOLUCIONADOR: MockSessionState, SilentStreamlit, MockDB y la ejecución aislada
+# viven en exam_runner.py (los subprocesos lo importan sin levantar la app)
 # ==============================================================================
 
-class SilentStreamlit:
-    """
-    Simula ser 'st' para ejecutar el examen sin interfaz gráfica.
-    Devuelve tipos de datos compatibles para evitar TypeErrors durante la simulación.
-    """
-    def __init__(self, fixed_input):
-        self.fixed_input = str(fixed_input)
-        self.secrets = st.secrets
-        
-        # --- CORRECCIÓN CLAVE AQUÍ ---
-        # 1. Usamos MockSessionState en vez de un dict normal para permitir .user_session
-        self.session_state = MockSessionState()
-        
-        # 2. INYECCIÓN DE SESIÓN:
-        # Pre-llenamos los datos para que la Plantilla v9 crea que ya estamos logueados.
-        # Esto evita que el script se detenga en la pantalla de login.
-        self.session_state.user_session = {
-            "verified": True,
-            "id": self.fixed_input,
-            "section": "ACADEMIA TEC" # Sección por defecto para simulaciones
-        }
-        
-    # --- PROPIEDADES DE LAYOUT ---
-    @property
-    def sidebar(self):
-        return self
-        
-    def container(self, **kwargs):
-        return self
-
-    def columns(self, spec, **kwargs):
-        count = spec if isinstance(spec, int) else len(spec)
-        return [self] * count
-        
-    def tabs(self, tabs_list, **kwargs):
-        return [self] * len(tabs_list)
-        
-    def expander(self, label, **kwargs):
-        return self
-        
-    def form(self, key, **kwargs):
-        return self
-
-    # --- WIDGETS DE ENTRADA (Manejo de Tipos de Datos) ---
-
-    def text_input(self, label, **kwargs):
-        # Si el label sugiere que es el ID, devolvemos el ID fijo.
-        label_lower = label.lower()
-        if "id" in label_lower or "cédula" in label_lower or "cedula" in label_lower:
-            return self.fixed_input
-        # Si pide nombre para el badge, devolvemos un nombre falso
-        if "nombre" in label_lower:
-            return "Estudiante Simulado"
-        return "dummy_text"
-    
-    def number_input(self, label, **kwargs):
-        return 1.0 
-    
-    def slider(self, label, min_value=0, max_value=100, **kwargs):
-        return min_value
-
-    def radio(self, label, options, **kwargs):
-        return options[0] if options else None
-
-    def selectbox(self, label, options, **kwargs):
-        return options[0] if options else None
-        
-    def multiselect(self, label, options, **kwargs):
-        return [options[0]] if options else []
-
-    def checkbox(self, label, **kwargs):
-        return False
-        
-    def button(self, label, **kwargs):
-        # Importante: devolver False para botones de acción (como Login o Emitir Badge)
-        # para que no intenten ejecutar lógica externa, EXCEPTO si es form_submit
-        return False 
-
-    def date_input(self, label, **kwargs):
-        from datetime import date
-        return date.today()
-
-    def time_input(self, label, **kwargs):
-        from datetime import datetime
-        return datetime.now().time()
-        
-    def file_uploader(self, label, **kwargs):
-        return None
-        
-    def form_submit_button(self, label="Submit", **kwargs):
-        # Simulamos que el botón de enviar respuesta SIEMPRE se presiona
-        # para forzar el cálculo de validación
-        return True
-        
-    # --- MÉTODOS DE SALIDA (No hacen nada) ---
-    def markdown(self, *args, **kwargs): pass
-    def title(self, *args, **kwargs): pass
-    def header(self, *args, **kwargs): pass
-    def subheader(self, *args, **kwargs): pass
-    def caption(self, *args, **kwargs): pass
-    def code(self, *args, **kwargs): pass
-    def write(self, *args, **kwargs): pass
-    def info(self, *args, **kwargs): pass
-    def success(self, *args, **kwargs): pass
-    def warning(self, *args, **kwargs): pass
-    def error(self, *args, **kwargs): pass
-    def json(self, *args, **kwargs): pass
-    def metric(self, *args, **kwargs): pass
-    def toast(self, *args, **kwargs): pass
-    def balloons(self, *args, **kwargs): pass
-    def spinner(self, *args, **kwargs): return self 
-    def link_button(self, *args, **kwargs): pass
-
-    # --- CONTROL DE FLUJO ---
-    def stop(self):
-        # Ignoramos stop() para que el script siga corriendo y revele las variables
-        pass
-    
-    def rerun(self):
-        pass
-    
-    # --- CONTEXT MANAGERS ---
-    def __enter__(self):
-        return self
-    
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
-
-    def __iter__(self):
-        yield self
-
-    def __getattr__(self, name):
-        # Catch-all para cualquier cosa que se nos haya olvidado
-        return lambda *args, **kwargs: self
-        
-
-class MockDB:
-    """Simula la BD para forzar que el examen se ejecute (ignora si ya aprobó)."""
-    def check_student_status(self, exam_id, student_id):
-        # Siempre dice que NO ha aprobado para que el código calcule la solución
-        return {"has_passed": False, "score": 0}
-        
-    def register_attempt(self, *args, **kwargs):
-        return 0, 0
+def solver_limits():
+    """Límites de cada ejecución del Solucionador (configurables en st.secrets)."""
+    return {
+        "timeout": float(st.secrets.get("SOLVER_TIMEOUT_SECONDS", exam_runner.DEFAULT_TIMEOUT_SECONDS)),
+        "cpu_seconds": int(st.secrets.get("SOLVER_CPU_SECONDS", exam_runner.DEFAULT_CPU_SECONDS)),
+        "memory_mb": int(st.secrets.get("SOLVER_MEMORY_MB", exam_runner.DEFAULT_MEMORY_MB)),
+    }
 
+def parse_student_ids(text):
+    """Cédulas de un texto pegado o de un archivo: separadas por líneas, comas, ';' o espacios."""
+    for sep in ",;\t":
+        text = text.replace(sep, " ")
+    # Solo tokens con algún dígito: así se descarta el encabezado de un CSV ("cedula")
+    return list(dict.fromkeys(tok for tok in text.split() if any(ch.isdigit() for ch in tok)))
 
 
 # ==============================================================================
@@ -547,6 +2020,25 @@ def render_admin_panel():
     with st.sidebar:
         st.header("Panel de Control", divider=True)
         st.caption("Modo Administrador Activo (Hora VE)")
+        cache_stats = get_compiled_exam_cache().stats()
+        st.caption(
+            f"Caché de exámenes: {cache_stats['hits']} aciertos / {cache_stats['misses']} fallos "
+            f"({cache_stats['disk_hits']} leídos de disco)"
+        )
+        version_stats = get_exam_version_cache().stats()
+        st.caption(f"Versiones: {version_stats['exams']} exámenes vigilados, revalidados cada {version_stats['ttl']:g} s")
+        solver_stats = get_solver_result_cache().stats()
+        st.caption(f"Caché del solucionador: {solver_stats['entries']} resultados · {solver_stats['hits']} aciertos")
+        artifact_stats = get_exam_artifact_cache().stats()
+        st.caption(
+            f"Caché por estudiante: {artifact_stats['bytes'] / 2**20:.1f} / {artifact_stats['max_bytes'] / 2**20:.0f} MB · "
+            f"{artifact_stats['hits']} aciertos / {artifact_stats['misses']} cálculos"
+        )
+        pool_stats = get_connection_pool().stats()
+        st.caption(
+            f"Pool BD: {pool_stats['in_use']}/{pool_stats['size']} en uso, {pool_stats['idle']} ociosas · "
+            f"espera media {pool_stats['wait_avg_ms']:.1f} ms (máx {pool_stats['wait_max_ms']:.0f} ms)"
+        )
         
         if st.button("Cerrar Sesión"):
             for key in list(st.session_state.keys()):
@@ -554,7 +2046,7 @@ def render_admin_panel():
             st.rerun()
 
     # --- AHORA SON 3 PESTAÑAS ---
-    tab_dashboard, tab_grades, tab_editor, tab_solver = st.tabs(["Dashboard", "Registro de calificaciones", "Editor de evaluaciones", " Respuestas"])
+    tab_dashboard, tab_grades, tab_editor, tab_solver, tab_perf = st.tabs(["Dashboard", "Registro de calificaciones", "Editor de evaluaciones", " Respuestas", "Rendimiento"])
     #tab_dashboard, tab_grades, tab_editor = st.tabs(["Dashboard Docente", "Libro de Notas", "Gestión de Exámenes"])
 
     # --------------------------------------------------------------------------
@@ -589,6 +2081,14 @@ def render_admin_panel():
             else:
                 exam_id_input = selection
                 st.info(f"Editando examen: **{exam_id_input}**")
+                meta = db_manager.get_exam_meta(selection)
+                if meta:
+                    st.caption(
+                        f"{meta['lines']} líneas · {meta['size_bytes'] / 1024:.1f} KB · "
+                        f"imports: {', '.join(meta['imports']) or '—'} · huella {meta['source_hash'][:12]}"
+                    )
+                else:
+                    st.caption("Guardado antes de la validación: se verificará al volver a guardarlo.")
             
         new_code = st.text_area("Código Python", height=350, key="editor_area")
 
@@ -602,11 +2102,27 @@ def render_admin_panel():
                 if not target_id:
                     st.error("Debe ingresar un ID para el examen")
                 else:
-                    db_manager.save_exam(target_id, new_code)
-                    get_cached_exam_code.clear() 
-                    st.success(f"¡Examen '{target_id}' guardado!")
-                    st.session_state['last_selection'] = target_id
-                    st.rerun()
+                    # Se compila aquí, antes de guardar: un examen que no compila nunca llega a los estudiantes
+                    try:
+                        compiled, metadata = compile_exam(target_id, new_code)
+                    except SyntaxError as e:
+                        compiled = None
+                        st.error(f"❌ Error de sintaxis en la línea {e.lineno}, columna {e.offset}: {e.msg}")
+                        if e.text:
+                            st.code(e.text.rstrip("\n"), language="python")
+                    except ValueError as e:  # p. ej. bytes nulos pegados en el editor
+                        compiled = None
+                        st.error(f"❌ El código no se puede compilar: {e}")
+
+                    if compiled is not None:
+                        code_hash = source_hash(new_code)
+                        db_manager.save_exam(target_id, new_code, code_hash, metadata)
+                        # Solo este examen: los demás siguen con sus cachés intactas
+                        invalidate_exam_caches(target_id)
+                        get_compiled_exam_cache().put(target_id, code_hash, compiled)
+                        st.success(f"¡Examen '{target_id}' guardado!")
+                        st.session_state['last_selection'] = target_id
+                        st.rerun()
 
         with c2:
             if selection != "➕ Crear Nuevo...":
@@ -617,6 +2133,7 @@ def render_admin_panel():
                     
                     if st.button("Sí, borrar definitivamente", type="primary"):
                         db_manager.delete_exam(selection)
+                        invalidate_exam_caches(selection)
                         st.toast(f"Examen '{selection}' eliminado correctamente", icon="🗑️")
                         st.session_state['last_selection'] = None
                         st.rerun()
@@ -639,61 +2156,84 @@ def render_admin_panel():
         
         @st.fragment
         def render_grades_table():
-            # 1. Cargar datos
-            df = get_cached_all_grades()
-            
-            # 2. Preparar el CSV con la data completa antes de renderizar botones
-            csv_data = df.to_csv(index=False).encode('utf-8') if not df.empty else None
-
-            # 3. Layout de 4 columnas: [Refrescar] [CSV] [Filtro Examen] [Filtro Cédula] <--- CAMBIO AQUÍ
+            # 1. Layout de 4 columnas: [Refrescar] [CSV] [Filtro Examen] [Filtro Cédula]
             c_refresh, c_csv, c_filter_exam, c_filter_id = st.columns([1.2, 0.6, 2.1, 2.1], vertical_alignment="top")
             
             with c_refresh:
                 st.button("Refrescar Tabla", width="stretch")
             
             with c_csv:
-                if csv_data:
-                    st.download_button(
-                        label="📥",
-                        data=csv_data,
-                        file_name="notas_ve.csv",
-                        mime="text/csv",
-                        help="Descargar todo en CSV",
-                        width="stretch"
-                    )
-            
+                # La exportación solo se genera al pedirla (no en cada rerun del fragmento)
+                with st.popover("📥", help="Descargar todo el libro de notas", width="stretch"):
+                    formatos = ["csv", "csv.gz"] + (["parquet"] if pa is not None else [])
+                    fmt = st.radio("Formato", formatos, horizontal=True,
+                                   format_func={"csv": "CSV", "csv.gz": "CSV (gzip)", "parquet": "Parquet"}.get)
+                    if st.button("Generar archivo", width="stretch"):
+                        previo = st.session_state.pop("grades_export", None)
+                        if previo and os.path.exists(previo["path"]):
+                            os.remove(previo["path"])
+                        with st.spinner("Exportando..."):
+                            st.session_state["grades_export"] = {"path": export_gradebook(fmt), "fmt": fmt}
+
+                    export = st.session_state.get("grades_export")
+                    if export and os.path.exists(export["path"]):
+                        ext, mime = EXPORT_FORMATS[export["fmt"]]
+                        with open(export["path"], "rb") as f:
+                            st.download_button(
+                                label=f"Descargar ({os.path.getsize(export['path']) / 1024:.0f} KB)",
+                                data=f,
+                                file_name=f"notas_ve{ext}",
+                                mime=mime,
+                                on_click=discard_grades_export,
+                                width="stretch"
+                            )
+
+            # 2. Filtros
             with c_filter_exam:
-                if not df.empty:
-                    filtro_exam = st.multiselect(
-                        "Filtrar por Examen", 
-                        df['exam_id'].unique(), 
-                        label_visibility="collapsed", 
-                        placeholder="Filtrar por examen..."
-                    )
-                else:
-                    filtro_exam = []
+                filtro_exam = st.multiselect(
+                    "Filtrar por Examen", 
+                    get_cached_grade_exam_ids(), 
+                    label_visibility="collapsed", 
+                    placeholder="Filtrar por examen..."
+                )
 
-            # --- NUEVO BLOQUE PARA CÉDULA ---
             with c_filter_id:
                 filtro_cedula = st.text_input(
                     "Filtrar por Cédula", 
-                    placeholder="🔍 Buscar Cédula...", 
+                    placeholder="🔍 Cédula (empieza por)...", 
                     label_visibility="collapsed"
-                )
-            # --------------------------------
+                ).strip()
+
+            c_sort, c_size = st.columns([4.8, 1.2], vertical_alignment="top")
+            etiquetas_orden = {
+                "last_updated": "Más recientes primero",
+                "score": "Mayor nota primero",
+                "student_id": "Por cédula",
+                "exam_id": "Por examen",
+            }
+            with c_sort:
+                orden = st.selectbox("Ordenar por", list(GRADE_SORTS), format_func=etiquetas_orden.get,
+                                     label_visibility="collapsed")
+            with c_size:
+                page_size = st.selectbox("Filas por página", [25, 50, 100, 200], index=1,
+                                         label_visibility="collapsed")
+
+            # Si cambian filtros u orden, volvemos a la primera página
+            firma = (tuple(filtro_exam), filtro_cedula, orden, page_size)
+            if st.session_state.get("grades_query_sig") != firma:
+                st.session_state["grades_query_sig"] = firma
+                st.session_state["grades_page"] = 1
+            page = st.session_state.get("grades_page", 1)
+
+            # 3. Filtrado, orden y paginación los resuelve la BD: solo viaja una página
+            df, total = db_manager.query_grades(filtro_exam, filtro_cedula, orden, page, page_size)
+            total_pages = max(1, -(-total // page_size))
+            if page > total_pages:  # p. ej. se borraron filas desde la última consulta
+                page = st.session_state["grades_page"] = total_pages
+                df, total = db_manager.query_grades(filtro_exam, filtro_cedula, orden, page, page_size)
 
             # 4. Renderizado de la tabla
-            if not df.empty:
-                # Aplicamos filtro de EXAMEN
-                if filtro_exam:
-                    df = df[df['exam_id'].isin(filtro_exam)]
-                
-                # --- APLICAMOS FILTRO DE CÉDULA ---
-                if filtro_cedula:
-                    # Convierte a string y busca coincidencia parcial (case insensitive)
-                    df = df[df['student_id'].astype(str).str.contains(filtro_cedula, case=False, na=False)]
-                # ----------------------------------
-                
+            if total:
                 st.dataframe(
                     df, 
                     width='stretch',
@@ -703,6 +2243,15 @@ def render_admin_panel():
                         "last_updated": st.column_config.DatetimeColumn("Fecha (VE)", format="DD/MM/YYYY hh:mm a", width="content")
                     }
                 )
+                c_page, c_info = st.columns([1.2, 4.8], vertical_alignment="center")
+                with c_page:
+                    st.number_input("Página", min_value=1, max_value=total_pages, step=1,
+                                    key="grades_page", label_visibility="collapsed")
+                with c_info:
+                    desde = (page - 1) * page_size + 1
+                    st.caption(f"Mostrando {desde}–{desde + len(df) - 1} de {total} registros · página {page} de {total_pages}")
+            elif filtro_exam or filtro_cedula:
+                st.info("Ningún registro coincide con los filtros.")
             else:
                 st.info("No hay registros aún.")
 
@@ -716,10 +2265,10 @@ def render_admin_panel():
         
         @st.fragment
         def render_dashboard_content():
-            # 1. Cargar datos PRIMERO para poder llenar el selector
-            df = get_cached_all_grades()
+            # 1. Cargar la lista de exámenes PRIMERO para poder llenar el selector
+            lista_examenes = get_cached_grade_exam_ids()
             
-            if df.empty:
+            if not lista_examenes:
                 st.info("No hay suficientes datos para mostrar el dashboard.")
                 if st.button("Reintentar"): st.rerun()
                 return 
@@ -733,7 +2282,6 @@ def render_admin_panel():
                     pass 
 
             with c_sel:
-                lista_examenes = list(df['exam_id'].unique())
                 seleccion_dash = st.multiselect(
                     "Filtrar Dashboard", 
                     lista_examenes,
@@ -745,43 +2293,26 @@ def render_admin_panel():
             #st.divider() 
             
             # --- LÓGICA DE FILTRADO ---
-            if seleccion_dash:
-                df_view = df[df['exam_id'].isin(seleccion_dash)].copy()
-            else:
-                df_view = df.copy()
+            # Todo se agrega en la BD: aquí solo llegan KPIs y tablas de pocas filas
+            filtro_dash = tuple(sorted(seleccion_dash))
+            resumen = get_cached_dashboard_summary(filtro_dash)
+            hay_datos = resumen["registros"] > 0
 
-            # Asegurar tipos de datos para cálculos
-            df_view['score'] = pd.to_numeric(df_view['score'])
-            df_view['attempts'] = pd.to_numeric(df_view['attempts'])
-            df_view['last_updated'] = pd.to_datetime(df_view['last_updated'])
-
-            # --- 1. CÁLCULOS DE POBLACIÓN (Set Theory) ---
-            set_todos = set(df_view['student_id'])
-            set_aprobados = set(df_view[df_view['is_correct'] == True]['student_id'])
-            set_sin_aprobar = set_todos - set_aprobados
-            
-            total_unicos = len(set_todos)
-            total_sin_aprobar = len(set_sin_aprobar)
-            total_registros = len(df_view)
+            # --- 1. CÁLCULOS DE POBLACIÓN ---
+            total_unicos = resumen["unicos"]
+            total_aprobados = resumen["aprobados"]
+            total_sin_aprobar = total_unicos - total_aprobados
+            total_registros = resumen["registros"]
 
             # --- 2. CÁLCULOS DE RENDIMIENTO ---
-            df_aprobados = df_view[df_view['is_correct'] == True]
-            
             # A. Promedio Global (Toda la sección, incluyendo reprobados gauss)
-            if not df_view.empty:
-                promedio_global = df_view['score'].mean()
-            else:
-                promedio_global = 0
+            promedio_global = resumen["promedio_global"]
 
             # B. Promedio solo de los que aprobaron (Para comparar)
-            if not df_aprobados.empty:
-                promedio_aprobados = df_aprobados['score'].mean()
-                promedio_intentos = df_aprobados['attempts'].mean() # Intentos hasta lograr el éxito
-            else:
-                promedio_aprobados = 0
-                promedio_intentos = 0
+            promedio_aprobados = resumen["promedio_aprobados"]
+            promedio_intentos = resumen["promedio_intentos"] # Intentos hasta lograr el éxito
             
-            tasa_exito_real = (len(set_aprobados) / total_unicos) if total_unicos > 0 else 0
+            tasa_exito_real = (total_aprobados / total_unicos) if total_unicos > 0 else 0
 
             # --- VISUALIZACIÓN DE KPIs ---
             # ==================================================================
@@ -793,7 +2324,7 @@ def render_admin_panel():
                 #st.write("") # Espaciador
                 c1, c2 = st.columns(2)
                 c1.metric("Total Estudiantes Únicos", total_unicos, delta=f"{total_registros} registros totales", delta_color="off", border=True)
-                c2.metric("Estudiantes Sin Aprobar", total_sin_aprobar, delta=f"{len(set_aprobados)} ya aprobaron", border=True)
+                c2.metric("Estudiantes Sin Aprobar", total_sin_aprobar, delta=f"{total_aprobados} ya aprobaron", border=True)
                 
                 # st.write("") # Espaciador
 
@@ -834,8 +2365,8 @@ def render_admin_panel():
                 
                 # Calcular Eficiencia Global
                 # Suma total de puntos del salón / Suma total de intentos del salón
-                total_puntos = df_view['score'].sum()
-                total_intentos = df_view['attempts'].sum()
+                total_puntos = resumen["total_puntos"]
+                total_intentos = resumen["total_intentos"]
                 
                 if total_intentos > 0:
                     eficiencia = total_puntos / total_intentos
@@ -864,19 +2395,17 @@ def render_admin_panel():
                 
                 with col_g1:
                     st.markdown("**Distribución Global de Notas (0 - 20)**")
-                    if not df_view.empty:
+                    if hay_datos:
                         # 1. Crear estructura base (Eje X de 0 a 20)
                         chart_data = pd.DataFrame(index=range(21))
                         
-                        # 2. Separar notas y redondear
-                        # Notas < 9.5 se consideran reprobadas (columna 0-9)
-                        notas_reprobados = df_view[df_view['score'] < 9.5]['score'].round(0).astype(int)
-                        # Notas >= 9.5 se consideran aprobadas (columna 10-20)
-                        notas_aprobados = df_view[df_view['score'] >= 9.5]['score'].round(0).astype(int)
+                        # 2. Conteos por nota redondeada, ya separados por la BD
+                        # Notas < 9.5 se consideran reprobadas (columna 0-9), >= 9.5 aprobadas (10-20)
+                        hist = resumen["histograma"]
                         
                         # 3. Llenar conteos
-                        chart_data['Reprobados'] = notas_reprobados.value_counts()
-                        chart_data['Aprobados'] = notas_aprobados.value_counts()
+                        chart_data['Reprobados'] = hist[hist['aprobado'] == 0].set_index('nota')['n']
+                        chart_data['Aprobados'] = hist[hist['aprobado'] == 1].set_index('nota')['n']
                         
                         # Rellenar con 0 donde no haya estudiantes (limpieza visual)
                         chart_data = chart_data.fillna(0)
@@ -887,49 +2416,49 @@ def render_admin_panel():
                         st.bar_chart(chart_data, color=["#FF4B4B", "#4CAF50"], stack=True)
                         
                         # Datos extra textuales
-                        min_nota = df_view['score'].min()
-                        max_nota = df_view['score'].max()
+                        min_nota = resumen["min_nota"]
+                        max_nota = resumen["max_nota"]
                         st.caption(f"Rango de notas registrado: {min_nota:.1f} - {max_nota:.1f}")
                     else:
                         st.caption("Sin datos para mostrar.")
 
                 with col_g2:
                     st.markdown("**Actividad Reciente**")
-                    if not df_view.empty:
-                        df_view['fecha_dia'] = df_view['last_updated'].dt.date
-                        actividad = df_view.groupby('fecha_dia').size()
-                        st.line_chart(actividad)
+                    if hay_datos:
+                        actividad = resumen["actividad"]
+                        st.line_chart(actividad.set_index(pd.to_datetime(actividad['dia']))['registros'])
                         
                 #st.write("") # Espaciador vertical
                 st.subheader("Análisis de Comportamiento (Esfuerzo vs. Nota)", divider=True)
                 
-                if not df_view.empty:
+                if hay_datos:
                     import altair as alt # Asegúrate de que esto no de error, st ya lo trae
                     
-                    # Preparamos los datos para que el gráfico se vea lindo
-                    # Creamos una columna de "Estado" para el color
-                    df_chart = df_view.copy()
-                    df_chart['Estado'] = df_chart['is_correct'].apply(lambda x: "Aprobado" if x else "Reprobado")
+                    # Una burbuja por (intentos, nota entera, estado): el tamaño es cuántos estudiantes caen ahí
+                    df_chart = resumen["burbujas"].copy()
+                    df_chart['Estado'] = np.where(df_chart['is_correct'] == 1, "Aprobado", "Reprobado")
                     
                     # Definimos el Gráfico
-                    chart = alt.Chart(df_chart).mark_circle(size=200).encode(
+                    chart = alt.Chart(df_chart).mark_circle().encode(
                         # Eje X: Intentos
                         x=alt.X('attempts', title='Cantidad de Intentos'),
                         
                         # Eje Y: Nota
-                        y=alt.Y('score', title='Nota Obtenida', scale=alt.Scale(domain=[0, 20])),
+                        y=alt.Y('nota', title='Nota Obtenida', scale=alt.Scale(domain=[0, 20])),
+                        
+                        # Tamaño según cuántos estudiantes comparten el punto
+                        size=alt.Size('estudiantes', title='Estudiantes', scale=alt.Scale(range=[60, 1200])),
                         
                         # Color según si aprobó o no
                         color=alt.Color('Estado', scale=alt.Scale(domain=['Aprobado', 'Reprobado'], range=['#4CAF50', '#FF4B4B'])),
                         
-                        # TOOLTIP: ¡Esto es lo mejor! Al pasar el mouse ves quién es
                         tooltip=[
-                            alt.Tooltip('student_id', title='Cédula'),
-                            alt.Tooltip('score', title='Nota', format='.2f'),
                             alt.Tooltip('attempts', title='Intentos'),
-                            alt.Tooltip('last_updated', title='Último Acceso', format='%d/%m %H:%M')
+                            alt.Tooltip('nota', title='Nota (redondeada)'),
+                            alt.Tooltip('estudiantes', title='Estudiantes'),
+                            alt.Tooltip('Estado', title='Estado')
                         ]
-                    ) # Permite hacer zoom y pan
+                    )
                     
                     st.altair_chart(chart, width="stretch")
                     
@@ -944,24 +2473,26 @@ def render_admin_panel():
                 #st.write(" ")
                 st.subheader("Diagnóstico Automático del Curso", divider=True)
                 
-                if df_view.empty:
+                if not hay_datos:
                     st.info("No hay datos suficientes para generar el informe.")
                 else:
                     # --- 1. CÁLCULOS INTERNOS PARA EL INFORME ---
-                    # Recalculamos eficiencia localmente por si acaso
-                    sum_score = df_view['score'].sum()
-                    sum_try = df_view['attempts'].sum()
-                    eff_report = (sum_score / sum_try) if sum_try > 0 else 0
+                    eff_report = eficiencia
                     
-                    # Segmentación de Estudiantes
+                    # Segmentación de Estudiantes (conteos de la BD, ver DASHBOARD_SEGMENTS)
                     # A. LUCHADORES: Reprobados con muchos intentos (> 3) -> Necesitan ayuda
-                    struggling = df_view[(df_view['score'] < 9.5) & (df_view['attempts'] > 3)]
-                    
                     # B. ADIVINADORES: Aprobados pero con eficiencia baja (> 4 intentos) -> Fuerza bruta
-                    guessers = df_view[(df_view['score'] >= 9.5) & (df_view['attempts'] > 4)]
-                    
                     # C. ÉLITE: Aprobados con nota excelente (>=19) en 1 intento -> Eximibles/Monitores
-                    elite = df_view[(df_view['score'] >= 19.0) & (df_view['attempts'] == 1)]
+                    n_struggling = resumen["segmentos"]["struggling"]
+                    n_guessers = resumen["segmentos"]["guessers"]
+                    n_elite = resumen["segmentos"]["elite"]
+
+                    def lista_segmento(segment, cols, key):
+                        # Un expander ejecuta su contenido aunque esté cerrado: las filas
+                        # solo se piden a la BD cuando el docente activa el interruptor.
+                        if st.toggle("Ver lista", key=key):
+                            df_seg = get_cached_segment_members(filtro_dash, segment)
+                            st.dataframe(df_seg[cols], hide_index=True)
 
                     # --- 2. GENERACIÓN DEL TEXTO ---
                     
@@ -1006,30 +2537,27 @@ def render_admin_panel():
                     with c_act1:
                         st.markdown("**Atención Prioritaria**")
                         st.caption("Estudiantes que intentan mucho pero no logran aprobar (Frustración).")
-                        if not struggling.empty:
-                            st.error(f"{len(struggling)} Estudiantes")
-                            with st.expander("Ver lista"):
-                                st.dataframe(struggling[['student_id', 'attempts', 'score']], hide_index=True)
+                        if n_struggling:
+                            st.error(f"{n_struggling} Estudiantes")
+                            lista_segmento("struggling", ['student_id', 'attempts', 'score'], "seg_struggling")
                         else:
                             st.success("Ninguno detectado.")
 
                     with c_act2:
                         st.markdown("**Posible Adivinanza**")
                         st.caption("Aprobaron por persistencia, no necesariamente por conocimiento.")
-                        if not guessers.empty:
-                            st.warning(f"{len(guessers)} Estudiantes")
-                            with st.expander("Ver lista"):
-                                st.dataframe(guessers[['student_id', 'attempts', 'score']], hide_index=True)
+                        if n_guessers:
+                            st.warning(f"{n_guessers} Estudiantes")
+                            lista_segmento("guessers", ['student_id', 'attempts', 'score'], "seg_guessers")
                         else:
                             st.success("Bajo nivel de adivinanza.")
 
                     with c_act3:
                         st.markdown("**Cuadro de Honor**")
                         st.caption("Puntaje perfecto (o casi perfecto) al primer intento.")
-                        if not elite.empty:
-                            st.info(f"{len(elite)} Estudiantes")
-                            with st.expander("Ver lista"):
-                                st.dataframe(elite[['student_id', 'score']], hide_index=True)
+                        if n_elite:
+                            st.info(f"{n_elite} Estudiantes")
+                            lista_segmento("elite", ['student_id', 'score'], "seg_elite")
                         else:
                             st.caption("Nadie (aún).")
 
@@ -1038,7 +2566,7 @@ def render_admin_panel():
                     txt_conclusion = f"""
                     **Conclusión:**  
                     El curso tiene una eficiencia de **{eff_report:.1f}** puntos por intento. 
-                    Se recomienda contactar a los **{len(struggling)}** estudiantes en riesgo y felicitar a los **{len(elite)}** de alto rendimiento.
+                    Se recomienda contactar a los **{n_struggling}** estudiantes en riesgo y felicitar a los **{n_elite}** de alto rendimiento.
                     """
                     st.info(txt_conclusion, icon="🤖")
 
@@ -1070,88 +2598,208 @@ def render_admin_panel():
                     st.error("Seleccione un examen e ingrese una cédula.")
                     return # Salimos de la función sin error global
 
-                raw_code = db_manager.get_exam_code(exam_to_solve)
+                raw_code = load_exam_source(exam_to_solve)
                 
                 if not raw_code:
                     st.error("El código del examen está vacío.")
                 else:
-                    # 1. Sanitización (Quitar imports de streamlit)
-                    lines = raw_code.split('\n')
-                    safe_lines = [
-                        line for line in lines 
-                        if not line.strip().startswith("import streamlit") 
-                        and not line.strip().startswith("from streamlit")
-                    ]
-                    cleaned_code = "\n".join(safe_lines)
-
-                    # 2. Preparar entorno (Simulamos ST y DB)
-                    silent_st = SilentStreamlit(student_target)
-                    mock_db = MockDB()
+                    # 1. ¿Ya se resolvió este mismo código para esta cédula?
+                    solver_cache = get_solver_result_cache()
+                    huella = source_hash(raw_code)
+                    resultado = solver_cache.get(huella, student_target.strip())
+                    desde_cache = resultado is not None
+
+                    # 2. Si no: ejecutar con ST y DB simulados en un subproceso con límites
+                    #    (un bucle infinito o una matriz gigante no afectan al servidor)
+                    if not desde_cache:
+                        with st.spinner("Ejecutando el examen en un proceso aislado..."):
+                            resultado = exam_runner.solve_isolated(raw_code, exam_to_solve, student_target.strip(),
+                                                                   secrets=st.secrets.to_dict(), **solver_limits())
+                        if resultado["status"] == "ok":
+                            solver_cache.put(exam_to_solve, huella, resultado)
                     
-                    # Contexto inicial (variables que inyectamos nosotros)
-                    base_context_keys = {
-                        'st', 'pd', 'np', 'random', 'db', 'EXAM_ID', 'datetime', 
-                        'is_admin', '__builtins__'
-                    }
-                    
-                    context_solver = {
-                        'st': silent_st,
-                        'pd': pd,
-                        'np': np,
-                        'random': random,
-                        'db': mock_db,
-                        'EXAM_ID': exam_to_solve,
-                        'datetime': datetime,
-                        'is_admin': True
-                    }
-                    
-                    try:
-                        # 3. Ejecutar
-                        exec(cleaned_code, context_solver)
-                        
+                    if resultado["status"] == "timeout":
+                        st.warning(f"⏱️ {resultado['error']}. Revise si el examen tiene un bucle sin salida.")
+                    elif resultado["status"] == "memory":
+                        st.error(f"💾 {resultado['error']}. El examen intentó usar demasiada memoria.")
+                    elif resultado["error"]:
+                        st.error("Error ejecutando la simulación:")
+                        st.error(resultado["error"])
+                        with st.expander("Ver código ejecutado"):
+                            st.code(exam_runner.sanitize(raw_code))
+                    else:
                         st.divider()
                         st.markdown(f"#### Variables encontradas para: `{student_target}`")
+                        if desde_cache:
+                            st.caption("⚡ Resultado recordado (mismo código del examen, sin volver a ejecutarlo).")
                         
-                        # 4. Busqueda Prioritaria (Variables de respuesta común)
-                        priority_vars = ['solucion', 'solution', 'respuesta', 'result', 'answer']
-                        found_priority = False
-                        
-                        for var in priority_vars:
-                            if var in context_solver:
-                                val = context_solver[var]
-                                st.success(f"🎯 **{var}**: {val}")
-                                found_priority = True
+                        # 3. Busqueda Prioritaria (Variables de respuesta común)
+                        for var, val in resultado["priority"].items():
+                            st.success(f"🎯 **{var}**: {val}")
                         
-                        if not found_priority:
+                        if not resultado["priority"]:
                             st.caption("Mostrando todas las variables generadas:")
 
-                        # 5. Filtrado Inteligente de Variables (Muestra TODO lo que no sea basura)
-                        results_found = {}
-                        for k, v in context_solver.items():
-                            # Ignorar variables internas (_) o las que inyectamos nosotros
-                            if k.startswith('_') or k in base_context_keys:
-                                continue
-                            
-                            # Ignorar Módulos, Funciones y Clases (solo queremos datos)
-                            if isinstance(v, (types.ModuleType, types.FunctionType, type)):
-                                continue
-                                
-                            results_found[k] = v
-
-                        # Mostrar resultado limpio en JSON/Diccionario
-                        if results_found:
-                            st.json(results_found)
+                        # 4. Mostrar resultado limpio en JSON/Diccionario
+                        if resultado["variables"]:
+                            st.json(resultado["variables"])
                         else:
                             st.warning("El script se ejecutó pero no generó variables nuevas visibles.")
-                            
-                    except Exception as e:
-                        st.error("Error ejecutando la simulación:")
-                        st.error(str(e))
-                        with st.expander("Ver código ejecutado"):
-                            st.code(cleaned_code)
+
+            # ------------------------------------------------------------------
+            # CLAVE DE RESPUESTAS DE TODA UNA SECCIÓN (Pool de procesos)
+            # ------------------------------------------------------------------
+            st.subheader("Clave de Respuestas por Sección", divider=True)
+            st.caption("Resuelve el examen elegido arriba para cada cédula de la lista, en paralelo con todos los núcleos.")
+
+            c_ids, c_file = st.columns(2)
+            with c_ids:
+                ids_pegados = st.text_area("Cédulas (una por línea o separadas por comas)", height=150, key="solver_batch_ids")
+            with c_file:
+                archivo_ids = st.file_uploader("...o subir lista (CSV / TXT)", type=["csv", "txt"], key="solver_batch_file")
+
+            cedulas = parse_student_ids(ids_pegados or "")
+            if archivo_ids is not None:
+                cedulas = list(dict.fromkeys(cedulas + parse_student_ids(archivo_ids.getvalue().decode("utf-8", "ignore"))))
+            st.caption(f"{len(cedulas)} cédulas en la lista.")
+
+            if st.button("⚙️ Generar Clave de Respuestas", disabled=not (exam_to_solve and cedulas)):
+                raw_code = load_exam_source(exam_to_solve)
+                if not raw_code:
+                    st.error("El código del examen está vacío.")
+                    return
+
+                # Las cédulas ya resueltas con este mismo código salen de la caché; solo el resto va al pool
+                solver_cache = get_solver_result_cache()
+                huella = source_hash(raw_code)
+                previos = {sid: solver_cache.get(huella, sid) for sid in cedulas}
+                pendientes = [sid for sid, r in previos.items() if r is None]
+
+                barra = st.progress(0.0, text="Iniciando procesos...")
+                hechos = []
+
+                def avance(resultado):
+                    hechos.append(resultado)
+                    barra.progress(len(hechos) / len(pendientes), text=f"{len(hechos)} / {len(pendientes)} resueltos")
+
+                t0 = time.perf_counter()
+                nuevos = exam_runner.solve_batch(raw_code, exam_to_solve, pendientes,
+                                                 secrets=st.secrets.to_dict(), on_result=avance, **solver_limits())
+                barra.empty()
+                for r in nuevos:
+                    if r["status"] == "ok":
+                        solver_cache.put(exam_to_solve, huella, r)
+                    previos[r["student_id"]] = r
+                resultados = [previos[sid] for sid in cedulas]
+                st.session_state["solver_batch_result"] = {
+                    "exam_id": exam_to_solve,
+                    "df": exam_runner.results_to_frame(resultados),
+                    "seconds": time.perf_counter() - t0,
+                }
+
+            lote = st.session_state.get("solver_batch_result")
+            if lote:
+                df_lote = lote["df"]
+                estados = df_lote["estado"].value_counts() if not df_lote.empty else pd.Series(dtype=int)
+                avisos = [f"{icono} {int(estados[k])} {texto}"
+                          for k, icono, texto in [("error", "⚠️", "con error"), ("timeout", "⏱️", "sin tiempo"),
+                                                  ("memory", "💾", "sin memoria")] if k in estados]
+                st.markdown(f"**{lote['exam_id']}**: {len(df_lote)} cédulas en {lote['seconds']:.1f} s"
+                            + "".join(f" · {a}" for a in avisos))
+                st.dataframe(
+                    df_lote,
+                    hide_index=True,
+                    width="stretch",
+                    column_config={"tiempo_s": st.column_config.NumberColumn("Tiempo (s)", format="%.3f")}
+                )
+                st.download_button(
+                    "📥 Descargar clave (CSV)",
+                    data=df_lote.to_csv(index=False).encode("utf-8"),
+                    file_name=f"clave_{lote['exam_id']}.csv",
+                    mime="text/csv"
+                )
 
         # Ejecutar el fragmento
         render_solver_content()
+
+    # --------------------------------------------------------------------------
+    # PESTAÑA 5: RENDIMIENTO (Perfilador de renders de exámenes)
+    # --------------------------------------------------------------------------
+    with tab_perf:
+
+        @st.fragment
+        def render_perf_content():
+            profiler = get_render_profiler()
+            st.subheader("Rendimiento de Exámenes", divider=True)
+            st.caption("Mide una fracción de los renders de los estudiantes: traer el código, ejecutar la plantilla, "
+                       "llamadas a la BD y widgets (reloj y CPU del hilo), más las funciones más costosas según cProfile.")
+
+            c_rate, c_btn1, c_btn2 = st.columns([3, 1, 1], vertical_alignment="bottom")
+            with c_rate:
+                # Ajuste en caliente para todo el proceso (el valor inicial viene de PROFILE_SAMPLE_RATE).
+                # Solo al mover el slider: un rerun de otro admin no pisa el valor vigente
+                def apply_sample_rate():
+                    profiler.sample_rate = st.session_state["perf_rate"]
+
+                st.slider("Fracción de renders muestreados", 0.0, 1.0, value=float(profiler.sample_rate),
+                          step=0.01, key="perf_rate", on_change=apply_sample_rate)
+            with c_btn1:
+                st.button("Actualizar", width="stretch", key="perf_refresh")
+            with c_btn2:
+                if st.button("Reiniciar", width="stretch", key="perf_reset"):
+                    profiler.reset()
+
+            # Latencia de la BD por sentencia (siempre activa, independiente del muestreo)
+            with st.expander("Latencia de la BD por sentencia"):
+                db_stats = pd.DataFrame(get_db_metrics().snapshot())
+                if db_stats.empty:
+                    st.caption("Sin sentencias registradas todavía.")
+                else:
+                    st.dataframe(
+                        db_stats.sort_values("media_ms", ascending=False),
+                        hide_index=True,
+                        width="stretch",
+                        column_config={
+                            "media_ms": st.column_config.NumberColumn("Media (ms)", format="%.1f"),
+                            "p95_ms": st.column_config.NumberColumn("p95 ≤ (ms)", format="%.0f",
+                                                                    help="Límite superior del bucket del histograma"),
+                        }
+                    )
+
+            resumen = profiler.summary()
+            if resumen.empty:
+                if profiler.sample_rate == 0:
+                    st.info("El perfilado está desactivado. Suba la fracción de muestreo para empezar a medir.")
+                else:
+                    st.info("Aún no hay renders muestreados.")
+                return
+
+            st.markdown("**Exámenes ordenados por p95 del tiempo de render**")
+            ms = lambda label: st.column_config.NumberColumn(label, format="%.1f")
+            st.dataframe(
+                resumen,
+                hide_index=True,
+                width="stretch",
+                column_config={
+                    "p50_ms": ms("p50 (ms)"), "p95_ms": ms("p95 (ms)"), "cpu_p50_ms": ms("CPU p50 (ms)"),
+                    "fetch_ms": ms("Código (ms)"), "exec_ms": ms("Plantilla (ms)"),
+                    "db_ms": ms("BD (ms)"), "widgets_ms": ms("Widgets (ms)"),
+                }
+            )
+
+            examen = st.selectbox("Funciones más costosas de", resumen["exam_id"], key="perf_exam")
+            funciones = profiler.top_functions(examen)
+            if funciones.empty:
+                st.caption("Sin perfil de funciones para este examen todavía.")
+            else:
+                st.dataframe(
+                    funciones,
+                    hide_index=True,
+                    width="stretch",
+                    column_config={"tottime_ms": ms("Propio (ms)"), "cumtime_ms": ms("Acumulado (ms)")}
+                )
+
+        render_perf_content()
                         
 
 # ==============================================================================
@@ -1162,48 +2810,30 @@ def render_admin_panel():
 @st.cache_data(ttl=60, show_spinner=False) 
 def get_cached_leaderboard_view(exam_id):
     """
-    Procesa y ordena el ranking. El resultado se congela en RAM por 1 minuto.
+    Ranking de un examen. La BD filtra, ordena y numera solo los aprobados de ese
+    examen (no todo el libro de notas). El resultado se congela en RAM por 1 minuto.
     """
-    df = db_manager.get_all_grades()
+    df = db_manager.get_leaderboard(exam_id)
     
     if df.empty:
         return pd.DataFrame()
 
-    # Filtros y lógica igual que antes...
-    df_exam = df[(df['exam_id'] == exam_id) & (df['is_correct'] == True)].copy()
-    
-    if df_exam.empty:
-        return pd.DataFrame()
-
-    # Ordenar por Nota (Desc) y luego Tiempo (Asc)
-    df_exam['score'] = pd.to_numeric(df_exam['score'])
-    df_exam = df_exam.sort_values(by=['score', 'last_updated'], ascending=[False, True])
-    
-    # Asignar Posiciones
-    df_exam['Rank'] = range(1, len(df_exam) + 1)
-    
-    def get_medal(rank):
-        #if rank == 1: return "1ro"
-        #if rank == 2: return "2do"
-        #if rank == 3: return "3ro"
-        if rank <= 50: return f"{rank}"
-        return str(rank)
-    
-    df_exam['Posición'] = df_exam['Rank'].apply(get_medal)
-    
-    # Censurar IDs
-    def mask_id(sid):
-        s = str(sid)
-        return "•" * (len(s) - 4) + s[-4:] if len(s) > 4 else s
-        
-    df_exam['Estudiante'] = df_exam['student_id'].apply(mask_id)
-    
-    # Formatear Hora
-    #df_exam['Hora'] = pd.to_datetime(df_exam['last_updated']).dt.strftime('%H:%M:%S')
+    df['Posición'] = df['rank'].astype(str)
+    df['Estudiante'] = mask_student_ids(df['student_id'])
 
     # Retornar columnas limpias
     cols_show = ['Posición', 'Estudiante', 'score', 'attempts']
-    return df_exam[cols_show]
+    return df[cols_show]
+
+def mask_student_ids(ids):
+    """Censura las cédulas dejando visibles los últimos 4 dígitos (operación vectorizada)."""
+    s = ids.astype(str)
+    hidden = (s.str.len() - 4).clip(lower=0)
+    return pd.Series("•", index=s.index).str.repeat(hidden) + s.str[-4:]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_cached_leaderboard_position(exam_id, student_id):
+    return db_manager.get_leaderboard_position(exam_id, student_id)
     
 
 
@@ -1237,6 +2867,16 @@ def render_public_leaderboard(exam_id):
         height=600
     )
     
+    # Consulta puntual "¿En qué puesto voy?" (búsqueda indexada, no recorre el ranking)
+    with st.expander("🔎 Buscar mi posición"):
+        cedula = st.text_input("Cédula", key="ranking_lookup", placeholder="Ingresa tu cédula...").strip()
+        if cedula:
+            pos = get_cached_leaderboard_position(exam_id, cedula)
+            if pos:
+                st.success(f"Posición **{pos[0]}** de {len(df_view)} · Nota {float(pos[1]):.2f} · {pos[2]} intento(s)")
+            else:
+                st.warning("Esa cédula aún no aparece entre los aprobados de este examen.")
+
     # Mensaje técnico actualizado
     st.caption(f"⚡ Datos cacheados (Se actualizan cada 60 segundos). Última carga: {datetime.now().strftime('%H:%M:%S')}")
     
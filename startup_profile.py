@@ -0,0 +1,105 @@
+"""
+Perfil del arranque en frío de la app.
+
+Importa, en un intérprete nuevo con `python -X importtime`, los mismos módulos
+que importa microlms.py a nivel de módulo (se leen del propio archivo con
+ast, porque microlms.py no se puede importar sin levantar la app), y reporta
+el tiempo acumulado de cada uno. Es lo que paga Streamlit Cloud antes de que
+el primer estudiante vea algo tras despertar la app.
+
+Con --budget-ms el script falla (código de salida 1) si el total supera el
+presupuesto; con --extra se miden también módulos que no deberían estar en el
+arranque (p. ej. los de exam_runner.LAZY_MODULES) para ver cuánto se ahorra.
+
+Uso:
+    python startup_profile.py
+    python startup_profile.py --budget-ms 3000 --runs 3
+    python startup_profile.py --extra scipy matplotlib.pyplot plotly.express
+"""
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Línea de -X importtime: "import time:   self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def module_imports(path):
+    """Módulos importados a nivel de módulo (incluye los de try/except de dependencias opcionales)."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    nodes = list(tree.body)
+    while nodes:
+        node = nodes.pop(0)
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.append(node.module)
+        elif isinstance(node, ast.Try):
+            nodes[:0] = node.body
+    return list(dict.fromkeys(modules))
+
+
+def profile_imports(modules):
+    """
+    Importa los módulos en un intérprete nuevo. Retorna {módulo: ms acumulados}
+    solo para las importaciones de primer nivel (las que pide el código, no
+    sus dependencias internas), en el orden en que ocurrieron.
+    """
+    # Cada import va en su propio try: una dependencia opcional ausente no corta la medición
+    script = "\n".join(f"try:\n    import {m}\nexcept ImportError:\n    pass" for m in modules) or "pass"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=HERE, capture_output=True, text=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:  # Sin sangría extra = primer nivel
+            times[match.group(4)] = int(match.group(2)) / 1000
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de importación del arranque de la app.")
+    parser.add_argument("--app", default=os.path.join(HERE, "microlms.py"), help="Script cuyos imports se miden")
+    parser.add_argument("--extra", nargs="*", default=[], help="Módulos adicionales a medir")
+    parser.add_argument("--runs", type=int, default=1,
+                        help="Repeticiones; se toma el mínimo por módulo (la 1.ª suele ser la de disco frío)")
+    parser.add_argument("--top", type=int, default=15, help="Cuántos módulos mostrar")
+    parser.add_argument("--budget-ms", type=float, help="Falla si el total supera este valor")
+    args = parser.parse_args()
+
+    modules = module_imports(args.app) + [m for m in args.extra if m]
+    # Lo que importa el intérprete al arrancar (site, encodings...) no es de la app
+    interpreter = set(profile_imports([]))
+    best = {}
+    for _ in range(max(1, args.runs)):
+        for name, ms in profile_imports(modules).items():
+            if name not in interpreter:
+                best[name] = min(ms, best.get(name, ms))
+
+    missing = [m for m in modules if m.split(".")[0] not in {n.split(".")[0] for n in best}]
+    total = sum(best.values())
+    print(f"{'módulo':<32}{'ms':>10}{'%':>7}")
+    for name, ms in sorted(best.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<32}{ms:>10.1f}{ms / max(total, 1e-9):>7.0%}")
+    print(f"{'TOTAL':<32}{total:>10.1f}")
+    if missing:
+        print(f"\nNo se pudieron importar (o ya estaban cargados): {', '.join(missing)}")
+
+    if args.budget_ms is not None:
+        if total > args.budget_ms:
+            print(f"\n❌ El arranque ({total:.0f} ms) supera el presupuesto de {args.budget_ms:.0f} ms")
+            sys.exit(1)
+        print(f"\n✅ Arranque dentro del presupuesto ({total:.0f} / {args.budget_ms:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""El SQL dinámico del libro de notas y del dashboard, ejecutado con libsql (no con sqlite3)."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_schema  # noqa: E402
+
+libsql = pytest.importorskip("libsql_experimental")
+
+GRADES = [
+    # exam_id, student_id, attempts, score, is_correct, last_updated
+    ("A", "10111222", 1, 20.0, 1, "2026-01-10 08:00:00"),
+    ("A", "10222333", 4, 12.0, 1, "2026-01-11 09:00:00"),
+    ("A", "20333444", 6, 5.0, 0, "2026-01-12 10:00:00"),
+    ("B", "10111222", 2, 15.0, 1, "2026-01-13 11:00:00"),
+]
+
+
+@pytest.fixture
+def conn():
+    conn = libsql.connect(":memory:")
+    db_schema.apply_migrations(conn)
+    for row in GRADES:
+        conn.execute("INSERT INTO grades (exam_id, student_id, attempts, score, is_correct, last_updated) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", row)
+    conn.commit()
+    return conn
+
+
+@pytest.mark.parametrize("exam_ids, id_prefix, expected", [
+    (None, "", 4),
+    (["A"], "", 3),
+    (["A", "B"], "10", 3),
+    (["B"], "20", 0),
+])
+def test_grades_page_queries(conn, exam_ids, id_prefix, expected):
+    for sort_by in db_schema.GRADE_SORTS:
+        (count_sql, count_params), (page_sql, page_params) = db_schema.grades_page_queries(
+            exam_ids, id_prefix, sort_by, page=1, page_size=2)
+        assert conn.execute(count_sql, count_params).fetchone()[0] == expected
+        assert len(conn.execute(page_sql, page_params).fetchall()) == min(expected, 2)
+
+
+def test_grades_page_offset(conn):
+    _, (page_sql, page_params) = db_schema.grades_page_queries(sort_by="score", page=2, page_size=3)
+    assert [row[3] for row in conn.execute(page_sql, page_params).fetchall()] == [5.0]
+
+
+def test_dashboard_queries(conn):
+    queries = db_schema.dashboard_queries(["A"])
+    sql, params = queries["dashboard_kpis"]
+    kpis = conn.execute(sql, params).fetchone()
+    assert kpis[:3] == (3, 2, 3)                 # únicos, aprobados, registros
+    assert kpis[10:13] == (1, 0, 1)              # struggling, guessers, elite
+    for name in ("dashboard_histogram", "dashboard_activity", "dashboard_bubbles"):
+        sql, params = queries[name]
+        assert conn.execute(sql, params).fetchall()
+
+
+@pytest.mark.parametrize("exam_ids, segment, expected", [
+    (["A"], "struggling", ["20333444"]),
+    (["A"], "elite", ["10111222"]),
+    (["A", "B"], "guessers", []),
+])
+def test_segment_query(conn, exam_ids, segment, expected):
+    sql, params = db_schema.segment_query(exam_ids, segment)
+    assert [row[0] for row in conn.execute(sql, params).fetchall()] == expected
@@ -0,0 +1,26 @@
+"""Ninguna sentencia de DatabaseManager debe recorrer tablas completas."""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_schema  # noqa: E402
+
+
+@pytest.mark.skipif(sqlite3.sqlite_version_info < (3, 35, 0),
+                    reason="sin RETURNING no se pueden planificar las sentencias de escritura")
+def test_all_queries_use_indexes():
+    assert db_schema.audit_query_plans() == []
+
+
+def test_migrations_are_idempotent():
+    conn = sqlite3.connect(":memory:")
+    try:
+        version = db_schema.apply_migrations(conn)
+        assert version == db_schema.SCHEMA_MIGRATIONS[-1][0]
+        assert db_schema.apply_migrations(conn) == version
+    finally:
+        conn.close()